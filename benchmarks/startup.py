@@ -0,0 +1,99 @@
+"""
+Startup time benchmark for the cboco CLI.
+
+Runs each subcommand on the test data under `python -X importtime` and
+reports the total import time, along with the slowest top-level imports.
+
+    python benchmarks/startup.py [--repeat N] [--top N]
+"""
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATASET = os.path.join(ROOT, 'test_data', 'A.json')
+OTHER = os.path.join(ROOT, 'test_data', 'B.json')
+
+# the server runs until stopped: imports are read from what it has printed by then
+SERVE_SECONDS = 3.0
+
+
+def targets(tmp: str) -> dict:
+    """
+    Subcommand -> arguments; all are real runs against the test data, writing
+    any output under $tmp. Commands reading the output of another come after it.
+    """
+    shards = [os.path.join(tmp, 'shards', f'A_shard{i}of2.json') for i in range(2)]
+    partial = os.path.join(tmp, 'partial.npz')
+    return {
+        'help': ['--help'],
+        'unit': ['unit', DATASET],
+        'stats': ['stats', DATASET],
+        # subset has no dataset or output arguments, so can only show its help
+        'subset': ['subset', '--help'],
+        'union': ['union', DATASET, OTHER, '--collision-strategy', 'merge', '-o', os.path.join(tmp, 'union', 'union.json')],
+        'shard': ['shard', DATASET, '-n', '2', '--output-dir', os.path.join(tmp, 'shards')],
+        'merge': ['merge', *shards, '-o', os.path.join(tmp, 'merged', 'merged.json')],
+        'validate': ['validate', DATASET],
+        'eval': ['eval', DATASET, OTHER, '--partial-output', partial],
+        'combine': ['combine', partial],
+        'export-masks': ['export-masks', DATASET, '-o', os.path.join(tmp, 'masks'), '--processes', '1'],
+        'serve': ['serve', '--socket', os.path.join(tmp, 'serve.sock'), '--preload', DATASET],
+    }
+
+
+IMPORTTIME_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def importtimes(args):
+    env = dict(os.environ, PYTHONPATH=os.path.join(ROOT, 'src'))
+    command = [sys.executable, '-X', 'importtime', '-m', 'cboco', *args]
+    if args[0] == 'serve':
+        try:
+            subprocess.run(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, timeout=SERVE_SECONDS)
+        except subprocess.TimeoutExpired as e:
+            stderr = e.stderr.decode() if isinstance(e.stderr, bytes) else e.stderr or ''
+        else:
+            raise RuntimeError('Server stopped unexpectedly.')
+    else:
+        stderr = subprocess.run(
+            command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True,
+        ).stderr
+    rv = []
+    for line in stderr.splitlines():
+        m = IMPORTTIME_LINE.match(line)
+        if m:
+            _, cumulative, indent, name = m.groups()
+            rv.append((name, int(cumulative)*1e-3, len(indent)))
+    return rv
+
+
+def main():
+    parser = argparse.ArgumentParser('python benchmarks/startup.py')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per target; best is reported.')
+    parser.add_argument('--top', type=int, default=3, help='Number of slowest top-level imports to show.')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    print(' {:12} | {:>10} | {}'.format('Target', 'Total (ms)', 'Slowest imports (ms)'))
+    for target, target_args in targets(tmp).items():
+        best = None
+        for _ in range(args.repeat):
+            times = importtimes(target_args)
+            total = sum(t for _, t, depth in times if depth == 1)
+            if best is None or total < best[0]:
+                best = total, times
+        total, times = best
+        top_level = sorted([(t, n) for n, t, depth in times if depth == 1], reverse=True)[:args.top]
+        slowest = ', '.join(f'{n} {t:.1f}' for t, n in top_level)
+        print(' {:12} | {:>10.1f} | {}'.format(target, total, slowest))
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,2 +1,9 @@
 from .dataset import Dataset
-from .evaluation import evaluate_dataset
\ No newline at end of file
+
+
+def __getattr__(name: str):
+    # evaluation needs numpy, so is only imported when first used
+    if name in {'evaluate_dataset', 'evaluate_dataset_breakdown', 'OnlineEvaluator'}:
+        from . import evaluation
+        return getattr(evaluation, name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
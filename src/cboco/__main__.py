@@ -1,11 +1,14 @@
 import argparse
 import enum
-from typing import List, Optional
+from typing import List, Optional, Dict, Tuple
 import os
+import json
 from collections import defaultdict
 
-from . import Dataset
-from . import evaluate_dataset
+# Only light imports here: dependencies like numpy and cv2 are imported by the
+# commands that need them, so that the CLI starts quickly.
+from .dataset import Dataset, Annotation, iter_datasets
+from . import profiling
 
 
 class EnumAction(argparse.Action):
@@ -42,21 +45,40 @@ class SplitMethod(enum.Enum):
     random = 'random'
 
 
+class ShardMethod(enum.Enum):
+    """Dataset shard method: by hash of file name, by directory, or by image count."""
+    hash = 'hash'
+    dir = 'dir'
+    count = 'count'
+
+
+class MatchingMethod(enum.Enum):
+    """Prediction to truth matching: one-to-one in order of score (coco) or each truth takes its best prediction (legacy)."""
+    coco = 'coco'
+    legacy = 'legacy'
+
+
 class CollisionStrategy(enum.Enum):
     """Dataset union collision handling strategy."""
     merge = 'merge'
     error = 'error'
     preserve = 'preserve'
+    nms = 'nms'
+    average = 'average'
 
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser('python -m cboco')
+    parser.add_argument('--profile', action='store_true', help='Time each stage of the command and print a breakdown when done. Work done in worker processes (--bootstrap-processes, export-masks) is not included.')
+    parser.add_argument('--profile-output', type=str, default=None, help='Write profile to file: a ".json" file holds the timer breakdown, any other (e.g. ".prof") holds full cProfile stats of the main thread, for which eval loads datasets without prefetching. Implies --profile.')
     subps = parser.add_subparsers(dest='command')
     
     stats_command = subps.add_parser('stats', help='Get stats about a dataset')
     stats_command.add_argument('dataset', type=str, nargs='+', help='Dataset(s) to look at.')
     stats_command.add_argument('--scale', '-s', type=str, action='append', help='string defining pixel size in format "<filename regex>:<pixel size or ratio>"')
     stats_command.add_argument('--unit', type=str, default='μm', help='unit for scaled length. Default is micron.')
+    stats_command.add_argument('--combine', action='store_true', help='Also show statistics of all datasets taken together.')
+    stats_command.add_argument('--partial-output', type=str, required=False, help='Write statistics of all datasets taken together to json file, for use with "combine".')
 
     subset_command = subps.add_parser('subset', help='Carve a portion off a dataset')
     subset_command.add_argument('--method', type=SplitMethod, default=SplitMethod.random, action=EnumAction, help=SplitMethod.__doc__)
@@ -65,24 +87,79 @@ def parse_args() -> argparse.Namespace:
 
     union_command = subps.add_parser('union', help='Join two or more datasets together.')
     union_command.add_argument('--collision-strategy', type=CollisionStrategy, action=EnumAction, help=CollisionStrategy.__doc__, default=CollisionStrategy.error)
-    union_command.add_argument('dataset1', type=str, nargs=1, help='First dataset to combine.')
+    union_command.add_argument('dataset1', type=str, help='First dataset to combine.')
     union_command.add_argument('datasets', type=str, nargs='+', help='Rest of the datasets to combine.')
-    union_command.add_argument('--output', '-o', type=str, help='Name of resulting combined dataset.')
+    union_command.add_argument('--output', '-o', type=str, required=True, help='Name of resulting combined dataset.')
+    union_command.add_argument('--dedup-iou', type=float, default=0.5, help='IoU above which annotations of the same image and category are duplicates, for collision strategies "nms" and "average".')
+    union_command.add_argument('--dedup-mask', action='store_true', help='Find duplicates by mask IoU rather than box IoU.')
+    union_command.add_argument('--by-content', action='store_true', help='Identify images by a hash of their file contents rather than by file name, so copies under different paths are recognised.')
+    union_command.add_argument('--hash-workers', type=int, default=None, help='Number of threads hashing image files for --by-content.')
+    union_command.add_argument('--hash-cache', type=str, default=None, help='File in which to keep image hashes between runs, for --by-content. Files are rehashed if their size or modification time changes.')
+
+    shard_command = subps.add_parser('shard', help='Split a dataset into shards, keeping image, annotation and category IDs.')
+    shard_command.add_argument('dataset', type=str, help='Dataset to split.')
+    shard_command.add_argument('--count', '-n', type=int, required=True, help='Number of shards.')
+    shard_command.add_argument('--method', type=ShardMethod, default=ShardMethod.hash, action=EnumAction, help=ShardMethod.__doc__)
+    shard_command.add_argument('--output-dir', type=str, required=False, help='Directory to write shards to. Default is alongside dataset.')
+
+    merge_command = subps.add_parser('merge', help='Reassemble shards into one dataset.')
+    merge_command.add_argument('shards', type=str, nargs='+', help='Shards to merge.')
+    merge_command.add_argument('--output', '-o', type=str, required=True, help='Name of resulting merged dataset.')
+
+    combine_command = subps.add_parser('combine', help='Combine partial results written by "stats --partial-output" (.json) or "eval --partial-output" (.npz), e.g. from shards.')
+    combine_command.add_argument('partials', type=str, nargs='+', help='Partial results to combine.')
+    combine_command.add_argument('--values', '-v', type=str, default='AP_50,mAP,mF1', help='Comma-separated list of metrics to display for eval results. Set to "all" to display all.')
 
     # TODO
     # intersect_command = subps.add_parser('intersect', help='Get intersection of two or more datasets')
 
     unit_command = subps.add_parser('unit', help='Open dataset and do nothing. Useful for catching errors. Optionally write formatted file out.')
-    unit_command.add_argument('dataset', type=str, nargs=1, help='Dataset to look at.')
+    unit_command.add_argument('dataset', type=str, help='Dataset to look at.')
     unit_command.add_argument('--output', '-o', type=str, required=False, help='Name of resulting combined dataset.')
 
+    validate_command = subps.add_parser('validate', help='Check dataset for problems (duplicate ids, orphan annotations, degenerate or out of bounds polygons, missing or mis-sized image files), reporting all of them. Exits with status 1 if any are found.')
+    validate_command.add_argument('dataset', type=str, help='Dataset to check.')
+    validate_command.add_argument('--no-files', action='store_true', help='Do not check image files.')
+    validate_command.add_argument('--no-sizes', action='store_true', help='Check image files exist, but do not read them to check their size.')
+    validate_command.add_argument('--workers', type=int, default=None, help='Number of threads checking image files.')
+    validate_command.add_argument('--max-shown', type=int, default=10, help='Number of problems of each kind to show.')
+
     eval_command = subps.add_parser('eval', help='Evaluate one or more datasets with respect to a truth dataset.')
     eval_command.add_argument('truth', type=str, help='Dataset with "ground truth" annotations.')
     eval_command.add_argument('preds', type=str, nargs='+', help='Dataset(s) containing prediction object detections.')
     eval_command.add_argument('--output', '-o', type=str, required=False, help='Filename to write evaluation report to for each of dataset $preds.')
     eval_command.add_argument('--thresholds', '-t', type=str, default='coco', help='Comma-separated list of IoU thresholds (integers 0-100) to use to calculate metrics. Set to "coco" to use thresholds 50 to 95 in steps of 5.')
-    eval_command.add_argument('--values', '-v', type=str, nargs=1, default='AP_50,mAP,mF1', help='Comma-separated list of metrics to display. Set to "all" to display all. Default only valid for multiple IoU thresholds.')
+    eval_command.add_argument('--values', '-v', type=str, default='AP_50,mAP,mF1', help='Comma-separated list of metrics to display. Set to "all" to display all. Default only valid for multiple IoU thresholds.')
+    eval_command.add_argument('--mask', action='store_true', help='Match by mask IoU rather than box IoU.')
+    eval_command.add_argument('--memory-budget', type=int, default=None, help='With --mask, limit memory held by masks to about this many MB by evaluating images in chunks, releasing masks after each chunk. Default holds all masks.')
     eval_command.add_argument('--class-agnostic', action='store_true', help='Perform evaluation with no regard for particle class.')
+    eval_command.add_argument('--matching', type=MatchingMethod, default=MatchingMethod.coco, action=EnumAction, help=MatchingMethod.__doc__)
+    eval_command.add_argument('--breakdown', action='store_true', help='Also report metrics by category and by area range.')
+    eval_command.add_argument('--area-ranges', type=str, default='coco', help='Comma-separated list of area ranges for --breakdown in format "<name>:<min>:<max>" (square pixels). Set to "coco" to use small, medium and large as in COCO.')
+    eval_command.add_argument('--confusion', action='store_true', help='Also report confusion matrices of categories (plus background) at each threshold, from predictions matched regardless of category.')
+    eval_command.add_argument('--curves', type=str, default=None, help='Write precision-recall curves, overall and by category at each threshold, to .npz file. With several $preds, files are numbered.')
+    eval_command.add_argument('--recall-points', type=int, default=101, help='Number of recall levels (0 to 1) at which --curves are sampled.')
+    eval_command.add_argument('--bootstrap', type=int, default=0, help='Number of image-resampled bootstrap replicates used to calculate confidence intervals for each metric. Default (0) does not calculate intervals.')
+    eval_command.add_argument('--confidence', type=float, default=0.95, help='Confidence level of bootstrap intervals.')
+    eval_command.add_argument('--bootstrap-processes', type=int, default=None, help='Number of worker processes used for bootstrapping. Default is one per CPU.')
+    eval_command.add_argument('--partial-output', type=str, required=False, help='Write per-image results to .npz file, for use with "combine". With several $preds, files are numbered.')
+    eval_command.add_argument('--prefetch', type=int, default=None, help='Number of prediction datasets to load in the background while evaluating (default 2). Set to 0 to load sequentially. Not used with --cache.')
+    eval_command.add_argument('--cache', action='store_true', help='Reuse results of earlier evaluations of the same files and settings, and cache results of this one. Datasets are only loaded when needed. Cannot be used with --state or --prefetch.')
+    eval_command.add_argument('--cache-dir', type=str, default=None, help='Directory for --cache. Default is $CBOCO_CACHE_DIR, or ~/.cache/cboco.')
+    eval_command.add_argument('--state', type=str, default=None, help='Per-image results (.npz) kept between runs: only images whose annotations changed since the last run are re-evaluated. Created if missing. With several $preds, files are numbered.')
+    eval_command.add_argument('--cache-size', type=int, default=1024, help='Size limit of --cache in MB; least recently used results are removed beyond this.')
+
+    export_masks_command = subps.add_parser('export-masks', help='Write semantic and/or instance label images for each image in a dataset.')
+    export_masks_command.add_argument('dataset', type=str, help='Dataset to export.')
+    export_masks_command.add_argument('--output-dir', '-o', type=str, required=True, help='Directory to write label images to, under "semantic/" and "instance/".')
+    export_masks_command.add_argument('--kinds', type=str, default='semantic,instance', help='Comma-separated list of kinds of label image to write: "semantic" (category ids, which must be positive) and/or "instance" (annotation index).')
+    export_masks_command.add_argument('--processes', type=int, default=None, help='Number of worker processes drawing label images. Default is one per CPU.')
+
+    serve_command = subps.add_parser('serve', help='Run a local evaluation server, keeping truth datasets loaded between requests (see cboco.serve).')
+    serve_command.add_argument('--host', type=str, default='127.0.0.1', help='Address to listen on.')
+    serve_command.add_argument('--port', type=int, default=8642, help='Port to listen on.')
+    serve_command.add_argument('--socket', type=str, default=None, help='Listen on this unix socket instead of host and port. An old socket at the path is replaced; any other file is left and is an error.')
+    serve_command.add_argument('--preload', type=str, nargs='*', default=[], help='Truth datasets to load on startup.')
 
     args = parser.parse_args()
     command = str(args.command)
@@ -92,7 +169,34 @@ def parse_args() -> argparse.Namespace:
 
 def main():
     command, kwargs = parse_args()
-
+    profile = kwargs.pop('profile')
+    profile_output = kwargs.pop('profile_output')
+
+    if not (profile or profile_output):
+        run_command(command, kwargs)
+        return
+
+    profiling.enable()
+    profiler = None
+    if profile_output and not profile_output.endswith('.json'):
+        import cProfile
+        # cProfile only sees the main thread, so load datasets there
+        if command == 'eval' and not kwargs['cache']:
+            kwargs['prefetch'] = 0
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        run_command(command, kwargs)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_output)
+        elif profile_output:
+            profiling.write_report(profile_output)
+        profiling.print_report()
+
+
+def run_command(command: str, kwargs: dict):
     if command == 'stats':
         do_stats(**kwargs)
     elif command == 'intersect':
@@ -103,28 +207,55 @@ def main():
         do_subset(**kwargs)
     elif command == 'unit':
         do_unit(**kwargs)
+    elif command == 'validate':
+        do_validate(**kwargs)
     elif command == 'eval':
         do_eval(**kwargs)
+    elif command == 'shard':
+        do_shard(**kwargs)
+    elif command == 'merge':
+        do_merge(**kwargs)
+    elif command == 'export-masks':
+        do_export_masks(**kwargs)
+    elif command == 'serve':
+        do_serve(**kwargs)
+    elif command == 'combine':
+        do_combine(**kwargs)
     else:
         raise ValueError(f'Unhandled command {command}!')
 
 
-def do_stats(*, dataset: List[str], scale: List[str], unit: str):
+def print_statistics(dsname: str, stats: Dataset.Statistics, unit: str):
+    completion_pc = stats.num_annotated_images * 100. / stats.num_images
+
+    print(f'Dataset: {dsname}')
+    print(f'Annotated images: {stats.num_annotated_images}/{stats.num_images} ({completion_pc:.1f}%)')
+    print(f'Annotations by class:')
+    for cls, n in stats.num_annotations_by_class.items():
+        print(f' - {cls}: {n}')
+
+    print(f'Mean length {stats.mean_length:.1f} {unit} (σ={stats.stddev_length:.2f} {unit})')
+    print(f'Mean width {stats.mean_width:.1f} {unit} (σ={stats.stddev_width:.2f} {unit})')
+    print(f'Mean aspect_ratio {stats.mean_aspect_ratio:.3f} (σ={stats.stddev_aspect_ratio:.4f})')
+
+
+def do_stats(*, dataset: List[str], scale: List[str], unit: str, combine: bool, partial_output: Optional[str]):
+    # only use unit if scale is valid
+    unit = 'px' if not scale else unit
+
+    all_stats = []
     for dsname in dataset:
         stats = Dataset.from_json(dsname).collect_statistics(scale)
-        completion_pc = stats.num_annotated_images * 100. / stats.num_images
-
-        print(f'Dataset: {dsname}')
-        print(f'Annotated images: {stats.num_annotated_images}/{stats.num_images} ({completion_pc:.1f}%)')
-        print(f'Annotations by class:')
-        for cls, n in stats.num_annotations_by_class.items():
-            print(f' - {cls}: {n}')
+        all_stats.append(stats)
+        print_statistics(dsname, stats, unit)
 
-        # only use unit if scale is valid
-        unit = 'px' if not scale else unit
-        print(f'Mean length {stats.mean_length:.1f} {unit} (σ={stats.stddev_length:.2f} {unit})')
-        print(f'Mean width {stats.mean_width:.1f} {unit} (σ={stats.stddev_width:.2f} {unit})')
-        print(f'Mean aspect_ratio {stats.mean_aspect_ratio:.3f} (σ={stats.stddev_aspect_ratio:.4f})')
+    if combine or partial_output:
+        combined = Dataset.Statistics.combine(*all_stats)
+        if combine:
+            print_statistics('(combined)', combined, unit)
+        if partial_output:
+            with open(partial_output, 'w') as f:
+                json.dump(dict(unit=unit, statistics=combined.to_dict()), f, indent=2)
 
 
 def do_unit(*, dataset: str, output: Optional[str]):
@@ -133,6 +264,25 @@ def do_unit(*, dataset: str, output: Optional[str]):
         ds.to_json(output)
 
 
+def do_validate(*, dataset: str, no_files: bool, no_sizes: bool, workers: Optional[int], max_shown: int):
+    import sys
+    from .dataset.validate import validate_json
+
+    problems = validate_json(dataset, check_files=not no_files, check_size=not no_sizes, workers=workers)
+    by_kind = defaultdict(list)
+    for problem in problems:
+        by_kind[problem.kind].append(problem.message)
+    for kind, messages in by_kind.items():
+        print(f'{kind}: {len(messages)}')
+        for message in messages[:max_shown]:
+            print(f'  {message}')
+        if len(messages) > max_shown:
+            print(f'  ... and {len(messages) - max_shown} more')
+    if problems:
+        sys.exit(1)
+    print(f'No problems found in "{dataset}".')
+
+
 def do_subset(*, dataset: str, output: str, size: int, split_method: SplitMethod, by_total: bool):
     Dataset\
         .from_json(dataset)\
@@ -141,29 +291,183 @@ def do_subset(*, dataset: str, output: str, size: int, split_method: SplitMethod
         .to_json(output)
 
 
-def do_union(*, dataset1: str, dataset2: List[str], output: str, collision_strategy: CollisionStrategy):
-    datasets = [Dataset.from_json(fn) for fn in [dataset1, *dataset2]]
-    datasets[0]\
-        .union(*datasets[1:], collision_strategy=collision_strategy.value)\
+def do_union(*, dataset1: str, datasets: List[str], output: str, collision_strategy: CollisionStrategy, dedup_iou: float, dedup_mask: bool, by_content: bool, hash_workers: Optional[int], hash_cache: Optional[str]):
+    from . import hashing
+
+    datasets = [Dataset.from_json(fn) for fn in [dataset1, *datasets]]
+    iou_method = Annotation.IoUMethod.Mask if dedup_mask else Annotation.IoUMethod.Box
+    if hash_cache:
+        hashing.load_digests(hash_cache)
+    union = datasets[0].union(
+        *datasets[1:],
+        collision_strategy=collision_strategy.value,
+        dedup_iou=dedup_iou,
+        dedup_iou_method=iou_method,
+        identify_by='content' if by_content else 'name',
+        hash_workers=hash_workers,
+    )
+    if hash_cache:
+        hashing.save_digests(hash_cache)
+    union\
         .copy_files(os.path.dirname(output))\
         .to_json(output)
 
 
-def do_eval(*, truth: str, preds: List[str], output: Optional[str], thresholds: str, values: str, class_agnostic: bool):
+def parse_area_ranges(area_ranges: str) -> Optional[Dict[str, Tuple[float, float]]]:
+    if area_ranges == 'coco':
+        return None
+    rv = {}
+    for src in area_ranges.split(','):
+        name, lo, hi = src.strip().split(':')
+        rv[name] = float(lo), float(hi)
+    return rv
+
+
+def format_value(v) -> str:
+    if isinstance(v, tuple):
+        return ' - '.join(format_value(vi) for vi in v)
+    return f'{v:.4f}'
+
+
+def print_table(columns: List[str], results: Dict[str, List[float]], title='Metrics \\ Preds'):
+    print(' {:20} | {}'.format(title, ' | '.join([f'{c[-20:]:20}' for c in columns])))
+    for mname, mvalues in results.items():
+        print(' {:20} | {}'.format(mname, ' | '.join([format_value(mvalue).ljust(20) for mvalue in mvalues])))
+
+
+def print_confusion(categories: list, matrix: "np.ndarray", title: str):
+    names = [cat.name[:10] for cat in categories] + ['(none)']
+    print(' {:10} | {}'.format(title[:10], ' | '.join(f'{n:>10}' for n in names)))
+    for name, row in zip(names, matrix):
+        print(' {:10} | {}'.format(name, ' | '.join(f'{v:>10}' for v in row)))
+
+
+def numbered(fn: str, i: int, n: int) -> str:
+    """Filename $fn for the $i-th of $n outputs; numbered only if $n > 1."""
+    if n < 2:
+        return fn
+    stem, ext = os.path.splitext(fn)
+    return f'{stem}_{i}{ext}'
+
+
+def update_state(fn: str, ds_preds: Dataset, ds_truth: Dataset, iou_method: Annotation.IoUMethod, iou_thresh: List[float], class_agnostic: bool, matching: str, confusion: bool, memory_budget: Optional[int]):
+    from .evaluation import OnlineEvaluator
+
+    evaluator = None
+    if os.path.exists(fn):
+        evaluator = OnlineEvaluator.load(fn, ds_truth)
+        settings = (evaluator.iou_method, evaluator.iou_thresh, evaluator.class_agnostic, evaluator.matching, evaluator.confusion)
+        if settings != (iou_method, iou_thresh, class_agnostic, matching, confusion):
+            print(f'Settings differ from those of "{fn}", re-evaluating all images.')
+            evaluator = None
+    if evaluator is None:
+        evaluator = OnlineEvaluator(ds_truth, iou_method=iou_method, iou_thresh=iou_thresh, class_agnostic=class_agnostic, matching=matching, confusion=confusion)
+    changed = evaluator.update(ds_preds, memory_budget)
+    print(f'Re-evaluated {len(changed)} of {len(evaluator)} images.')
+    evaluator.save(fn)
+    return evaluator.accumulator
+
+
+def do_eval(*, truth: str, preds: List[str], output: Optional[str], thresholds: str, values: str, class_agnostic: bool, matching: MatchingMethod, breakdown: bool, area_ranges: str, bootstrap: int, confidence: float, bootstrap_processes: Optional[int], partial_output: Optional[str], prefetch: Optional[int], cache: bool, cache_dir: Optional[str], cache_size: int, state: Optional[str], confusion: bool, mask: bool, memory_budget: Optional[int], curves: Optional[str], recall_points: int):
+    from .evaluation import accumulate_dataset, breakdown_metrics, bootstrap_intervals, ResultCache, cached_accumulate, pr_curves, save_curves
+
+    if cache:
+        # cached results are looked up by file, datasets loaded only on a miss
+        conflicting = [name for name, given in [('--state', state), ('--prefetch', prefetch is not None)] if given]
+        if conflicting:
+            raise ValueError(f'--cache cannot be used with {", ".join(conflicting)}.')
+    if prefetch is None:
+        prefetch = 2
+
     if thresholds == 'coco':
         thresholds = [float(v)*0.01 for v in range(50, 100, 5)]
     else:
         thresholds = [float(v.strip())*0.01 for v in thresholds.split(',')]
+    area_ranges = parse_area_ranges(area_ranges)
+    iou_method = Annotation.IoUMethod.Mask if mask else Annotation.IoUMethod.Box
+    if memory_budget is not None:
+        memory_budget = memory_budget << 20
     
-    ds_truth = Dataset.from_json(truth)
     results_by_preds = {}
-    for pred in preds:
-        ds_preds = Dataset.from_json(pred)
-        results_by_preds[pred] = evaluate_dataset(
-            ds_preds, ds_truth,
-            iou_thresh=thresholds,
-            class_agnostic=class_agnostic,
+    breakdown_by_preds = {}
+    intervals_by_preds = {}
+    confusion_by_preds = {}
+    if cache:
+        # datasets are loaded only on a cache miss; truth at most once
+        result_cache = ResultCache(cache_dir, cache_size << 20)
+        loaded = {}
+        def load(fn):
+            if fn != truth:
+                return Dataset.from_json(fn)
+            if fn not in loaded:
+                loaded[fn] = Dataset.from_json(fn)
+            return loaded[fn]
+        get_truth = lambda: load(truth)
+        accumulators = (
+            (pred, cached_accumulate(
+                pred, truth, result_cache,
+                iou_method=iou_method,
+                iou_thresh=thresholds,
+                class_agnostic=class_agnostic,
+                matching=matching.value,
+                load=load,
+                confusion=confusion,
+                memory_budget=memory_budget,
+            ))
+            for pred in preds
         )
+    else:
+        # truth is loaded first, predictions are parsed in the background while
+        # the previous one is evaluated
+        datasets = iter_datasets([truth, *preds], prefetch=prefetch)
+        _, ds_truth = next(datasets)
+        get_truth = lambda: ds_truth
+        accumulators = (
+            (pred, update_state(
+                numbered(state, i, len(preds)), ds_preds, ds_truth,
+                iou_method=iou_method,
+                iou_thresh=thresholds,
+                class_agnostic=class_agnostic,
+                matching=matching.value,
+                confusion=confusion,
+                memory_budget=memory_budget,
+            ))
+            for i, (pred, ds_preds) in enumerate(datasets)
+        ) if state else (
+            # match once, then report metrics in each requested form
+            (pred, accumulate_dataset(
+                ds_preds, ds_truth,
+                iou_method=iou_method,
+                iou_thresh=thresholds,
+                class_agnostic=class_agnostic,
+                matching=matching.value,
+                confusion=confusion,
+                memory_budget=memory_budget,
+            ))
+            for pred, ds_preds in datasets
+        )
+
+    for pred, accumulator in accumulators:
+        results_by_preds[pred] = accumulator.metrics()
+        if partial_output:
+            accumulator.save(numbered(partial_output, len(results_by_preds) - 1, len(preds)))
+        if breakdown:
+            kwargs = dict(area_ranges=area_ranges) if area_ranges else {}
+            breakdown_by_preds[pred] = breakdown_metrics(accumulator, get_truth().categories, **kwargs)
+        if curves:
+            save_curves(
+                numbered(curves, len(results_by_preds) - 1, len(preds)),
+                pr_curves(accumulator, get_truth().categories, recall_points),
+            )
+        if confusion:
+            confusion_by_preds[pred] = accumulator.confusion_matrix([cat.id for cat in get_truth().categories])
+        if bootstrap:
+            intervals_by_preds[pred] = bootstrap_intervals(
+                accumulator,
+                confidence=confidence,
+                n_resamples=bootstrap,
+                processes=bootstrap_processes,
+            )
     
     possible_keys = set(list(results_by_preds.values())[0].keys())
     if values == 'all':
@@ -180,9 +484,24 @@ def do_eval(*, truth: str, preds: List[str], output: Optional[str], thresholds:
 
     print('Evalation results')
     print(f'\nTruth: {truth}\n')
-    print(' {:20} | {}'.format('Metrics \\ Preds', ' | '.join([f'{p[-20:]:20}' for p in preds])))
-    for mname, mvalues in results.items():
-        print(' {:20} | {}'.format(mname, ' | '.join([f'{mvalue:.4f}'.ljust(20) for mvalue in mvalues])))
+    print_table(preds, results)
+
+    if intervals_by_preds:
+        print(f'\nConfidence intervals ({confidence*100:g}%, {bootstrap} resamples)\n')
+        intervals = {k: [intervals_by_preds[p][k] for p in intervals_by_preds] for k in keys}
+        print_table(preds, intervals)
+
+    for pred, matrices in confusion_by_preds.items():
+        print(f'\nConfusion matrices for preds: {pred} (rows: truth, columns: predictions)')
+        for thresh, matrix in zip(thresholds, matrices):
+            print()
+            print_confusion(get_truth().categories, matrix, f'IoU > {thresh:.2f}')
+
+    for pred, pred_breakdown in breakdown_by_preds.items():
+        print(f'\nBreakdown for preds: {pred}\n')
+        for group in [pred_breakdown.by_category, pred_breakdown.by_area]:
+            print_table(list(group), {k: [m[k] for m in group.values()] for k in keys}, title='Metrics \\ Group')
+            print()
     
     if output is not None:
         if not output.endswith('.txt'):
@@ -194,8 +513,76 @@ def do_eval(*, truth: str, preds: List[str], output: Optional[str], thresholds:
             f.write(f'Truth: {truth}\n')
             for predname, pred_results in results_by_preds.items():
                 f.write(f'vs preds: {predname}\n')
+                pred_intervals = intervals_by_preds.get(predname, {})
                 for mname, mvalue in pred_results.items():
-                    f.write(f'  * {mname} = {mvalue}\n')
+                    if mname in pred_intervals:
+                        lo, hi = pred_intervals[mname]
+                        f.write(f'  * {mname} = {mvalue} ({lo} - {hi})\n')
+                    else:
+                        f.write(f'  * {mname} = {mvalue}\n')
+                if predname in breakdown_by_preds:
+                    pred_breakdown = breakdown_by_preds[predname]
+                    for gname, gresults in {**pred_breakdown.by_category, **pred_breakdown.by_area}.items():
+                        f.write(f'  {gname}:\n')
+                        for mname, mvalue in gresults.items():
+                            f.write(f'    * {mname} = {mvalue}\n')
+
+def do_shard(*, dataset: str, count: int, method: ShardMethod, output_dir: Optional[str]):
+    ds = Dataset.from_json(dataset)
+    if output_dir is None:
+        output_dir = ds.root
+    stem = os.path.splitext(os.path.basename(dataset))[0]
+    for i, shard in enumerate(ds.shard(count, method.value)):
+        output = os.path.join(output_dir, f'{stem}_shard{i}of{count}.json')
+        print(f'Writing {len(shard.images)} images to "{output}"')
+        shard.copy_files(output_dir).to_json(output)
+
+
+def do_merge(*, shards: List[str], output: str):
+    Dataset\
+        .merge([Dataset.from_json(fn) for fn in shards])\
+        .copy_files(os.path.dirname(output))\
+        .to_json(output)
+
+
+def do_combine(*, partials: List[str], values: str):
+    if all(fn.endswith('.json') for fn in partials):
+        unit = None
+        all_stats = []
+        for fn in partials:
+            with open(fn) as f:
+                data = json.load(f)
+            unit = data['unit']
+            all_stats.append(Dataset.Statistics.from_dict(data['statistics']))
+        print_statistics('(combined)', Dataset.Statistics.combine(*all_stats), unit)
+    elif all(fn.endswith('.npz') for fn in partials):
+        from .evaluation import Accumulator
+        metrics = Accumulator.merge([Accumulator.load(fn) for fn in partials]).metrics()
+        keys = list(metrics) if values == 'all' else [v.strip() for v in values.split(',')]
+        print_table(['(combined)'], {k: [metrics[k]] for k in keys})
+    else:
+        raise ValueError('Partial results must be all statistics (.json) or all evaluations (.npz).')
+
+
+def do_export_masks(*, dataset: str, output_dir: str, kinds: str, processes: Optional[int]):
+    Dataset.from_json(dataset).export_masks(output_dir, [k.strip() for k in kinds.split(',')], processes)
+
+
+def do_serve(*, host: str, port: int, socket: Optional[str], preload: List[str]):
+    from .serve import make_server
+
+    server = make_server(host, port, socket)
+    for fn in preload:
+        print(f'Loading "{fn}"')
+        server.truths.get(fn)
+    print(f'Serving evaluations on {socket or f"http://{host}:{port}"}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
 
 def todo(*_):
     raise NotImplementedError
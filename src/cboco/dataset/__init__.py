@@ -2,3 +2,16 @@ from .image import Image
 from .annotation import Annotation
 from .dataset import Dataset
 from .category import Category
+
+from .loader import iter_datasets
+
+
+def __getattr__(name: str):
+    # the IoU engine needs numpy, so is only imported when first used
+    if name in {'iou_matrix', 'areas_of'}:
+        from . import iou
+        return getattr(iou, name)
+    if name == 'deduplicate':
+        from .dedup import deduplicate
+        return deduplicate
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
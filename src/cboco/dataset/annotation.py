@@ -1,11 +1,11 @@
 from enum import Enum
-from typing import Dict, List, Tuple
-
-import numpy as np
-import cv2
+from typing import Dict, List, Tuple, Optional
 
 from .image import Image
-from .contour_size import measure_size_of_contour
+from .. import profiling
+
+# numpy and cv2 are imported where needed (when contours and masks are first
+# used), so that loading and saving datasets stays quick.
 
 
 class Annotation:
@@ -37,26 +37,12 @@ class Annotation:
             raise NotImplementedError
         self.extra = extra
 
-
+        self._contour = None
+        self._mask = None
+        self.image_size = None
         if image is not None:
-            seg = np.array(segmentation)
-            self.contour = seg.reshape(-1, 1, 2).astype(np.int32)
-
-            x1 = int(np.min(self.contour[..., 0]))
-            x2 = int(np.max(self.contour[..., 0]))
-            y1 = int(np.min(self.contour[..., 1]))
-            y2 = int(np.max(self.contour[..., 1]))
-
-            self.bbox = x1, y1, x2, y2
-            w, h = image.width, image.height
-            mask = np.zeros((h, w), np.uint8)
-            cv2.drawContours(mask, [self.contour], -1, 1, -1)
-            self.mask = mask.astype(bool)
-
+            self.compute_bbox(image.width, image.height)
             image.annotations.append(self)
-        else:
-            self.mask = None
-            self.contour = None
 
         self.is_tp = False
         self.relevant_iou = 0.0
@@ -64,16 +50,16 @@ class Annotation:
     @classmethod
     def from_contour(
         cls,
-        contour: np.ndarray,
+        contour: "np.ndarray",
         category_id: int,
         score: float = None,
         **extra,
     ) -> "Annotation":
         seg = [[int(i) for i in contour.reshape(-1)]]
-        x1 = int(np.min(contour[..., 0]))
-        x2 = int(np.max(contour[..., 0]))
-        y1 = int(np.min(contour[..., 1]))
-        y2 = int(np.max(contour[..., 1]))
+        x1 = int(contour[..., 0].min())
+        x2 = int(contour[..., 0].max())
+        y1 = int(contour[..., 1].min())
+        y2 = int(contour[..., 1].max())
         bbox = (x1, y1, x2, y2)
         return cls(
             id=-1,
@@ -86,9 +72,56 @@ class Annotation:
             **extra,
         )
     
+    def compute_bbox(self, width: int, height: int):
+        """
+        Set bounding box of annotation from its segmentation, and the size
+        ($width x $height) of the image on which its mask is drawn. The mask
+        itself is drawn when first used, but the segmentation is checked now.
+        """
+        xs, ys = [], []
+        for poly in self.segmentation:
+            if len(poly) % 2:
+                raise ValueError(f'Annotation {self.id} has a polygon with an odd number of coordinates.')
+            xs.extend(int(v) for v in poly[0::2])
+            ys.extend(int(v) for v in poly[1::2])
+        if not xs:
+            raise ValueError(f'Annotation {self.id} has an empty segmentation.')
+        self.bbox = min(xs), min(ys), max(xs), max(ys)
+        self.image_size = width, height
+        self._mask = None
+
+    @property
+    def contour(self) -> Optional["np.ndarray"]:
+        """(N, 1, 2) array of segmentation points, all polygons together."""
+        if self._contour is None and self.segmentation:
+            import numpy as np
+            seg = np.array([v for poly in self.segmentation for v in poly])
+            self._contour = seg.reshape(-1, 1, 2).astype(np.int32)
+        return self._contour
+
+    @property
+    def mask(self) -> Optional["np.ndarray"]:
+        """Boolean mask of annotation, or None if the image size is not known."""
+        if self._mask is None and self.image_size is not None:
+            self._mask = self.draw_mask()
+        return self._mask
+
+    @profiling.timed('Annotation.draw_mask')
+    def draw_mask(self) -> "np.ndarray":
+        import numpy as np
+        import cv2
+        w, h = self.image_size
+        mask = np.zeros((h, w), np.uint8)
+        cv2.drawContours(mask, [self.contour], -1, 1, -1)
+        return mask.astype(bool)
+
+    def release_mask(self):
+        """Free memory held by mask; it will be redrawn if used again."""
+        self._mask = None
+    
     def seg_iou(self, other: "Annotation"):
-        i = np.sum(self.mask & other.mask)
-        u = np.sum(self.mask | other.mask)
+        i = (self.mask & other.mask).sum()
+        u = (self.mask | other.mask).sum()
         return float(i) / float(u)
     
     def box_iou(self, other: "Annotation"):
@@ -144,10 +177,12 @@ class Annotation:
             segmentation=self.segmentation,
             bbox=self.bbox,
             iscrowd=self.iscrowd,
+            **({} if self.score is None else dict(score=self.score)),
             **self.extra
         )
 
     def get_width_length(self, scale=1.0) -> Tuple[float, float]:
+        from .contour_size import measure_size_of_contour
         assert self.contour is not None
         w, l = measure_size_of_contour(self.contour)
         return w*scale, l*scale
@@ -6,14 +6,12 @@ from dataclasses import dataclass
 from collections import defaultdict
 import shutil
 from copy import deepcopy
-
-from tqdm import tqdm
-import numpy as np
-import cv2
+import zlib
 
 from .annotation import Annotation
 from .category import Category
 from .image import Image
+from .. import profiling
 
 
 FILTER_FUNC = Callable[[List[Image], int], List[Image]]
@@ -35,6 +33,53 @@ class Dataset:
         stddev_width: float
         mean_aspect_ratio: float
         stddev_aspect_ratio: float
+
+        def to_dict(self) -> dict:
+            return {k: (dict(v) if isinstance(v, dict) else v) for k, v in self.__dict__.items()}
+
+        @classmethod
+        def from_dict(cls, d: dict) -> "Dataset.Statistics":
+            return cls(**d)
+
+        @classmethod
+        def combine(cls, *stats: "Dataset.Statistics") -> "Dataset.Statistics":
+            """
+            Combine statistics of disjoint datasets (e.g. shards) into those
+            of the whole. Means and standard deviations are pooled, weighted by
+            number of annotations.
+            """
+            def sum_dicts(attr):
+                rv = defaultdict(int)
+                for st in stats:
+                    for k, v in getattr(st, attr).items():
+                        rv[k] += v
+                return dict(rv)
+
+            def pool(mean_attr, stddev_attr):
+                n = sum(st.num_annotations for st in stats)
+                if not n:
+                    return float('nan'), float('nan')
+                mean = sum(st.num_annotations*getattr(st, mean_attr) for st in stats if st.num_annotations)/n
+                sq = sum(st.num_annotations*(getattr(st, stddev_attr)**2 + getattr(st, mean_attr)**2) for st in stats if st.num_annotations)/n
+                return mean, max(sq - mean**2, 0.0)**0.5
+
+            mean_length, stddev_length = pool('mean_length', 'stddev_length')
+            mean_width, stddev_width = pool('mean_width', 'stddev_width')
+            mean_aspect_ratio, stddev_aspect_ratio = pool('mean_aspect_ratio', 'stddev_aspect_ratio')
+            return cls(
+                sum(st.num_images for st in stats),
+                sum(st.num_annotations for st in stats),
+                sum_dicts('num_annotations_by_dir'),
+                sum(st.num_annotated_images for st in stats),
+                sum_dicts('num_annotated_images_by_dir'),
+                sum_dicts('num_annotations_by_class'),
+                mean_length=mean_length,
+                stddev_length=stddev_length,
+                mean_width=mean_width,
+                stddev_width=stddev_width,
+                mean_aspect_ratio=mean_aspect_ratio,
+                stddev_aspect_ratio=stddev_aspect_ratio,
+            )
         
 
     def __init__(
@@ -61,17 +106,25 @@ class Dataset:
         return image
     
     @classmethod
+    @profiling.timed('Dataset.from_json')
     def from_json(cls, fn: str):
-        with open(fn) as f:
+        with profiling.timer('Dataset.from_json: parse json'), open(fn) as f:
             data = json.load(f)
+        return cls.from_dict(data, root=os.path.dirname(fn))
 
+    @classmethod
+    def from_dict(cls, data: dict, root='.'):
+        """Dataset from COCO-format dict $data, with files relative to $root."""
         images = [Image(**im) for im in data['images']]
         images_by_id = {image.id: image for image in images}
         categories = [Category(**cat) for cat in data['categories']]
-        annotations = [Annotation(**ann, image=images_by_id[ann['image_id']]) for ann in data['annotations']]
+        with profiling.timer('Annotation construction'):
+            annotations = [Annotation(**ann, image=images_by_id[ann['image_id']]) for ann in data['annotations']]
+        profiling.count('images loaded', len(images))
+        profiling.count('annotations loaded', len(annotations))
 
         return cls(
-            root=os.path.dirname(fn),
+            root=root,
             images=images,
             categories=categories,
             annotations=annotations,
@@ -112,8 +165,10 @@ class Dataset:
             rv.append((pattern, scale))
         return list(reversed(rv))
 
+    @profiling.timed('Dataset.collect_statistics')
     def collect_statistics(self, scales: List[str]) -> Statistics:
-        scales = self.scales_from_strs(scales)
+        import numpy as np
+        scales = self.scales_from_strs(scales or [])
         num_images = len(self.images)
         num_annotations = len(self.annotations)
         num_annotated_images = 0
@@ -158,12 +213,12 @@ class Dataset:
             num_annotated_images,
             num_annotated_images_by_dir,
             num_annotations_by_class,
-            mean_length=np.mean(lengths),
-            stddev_length=np.std(lengths),
-            mean_width=np.mean(widths),
-            stddev_width=np.std(widths),
-            mean_aspect_ratio=np.mean(aspect_ratios),
-            stddev_aspect_ratio=np.std(aspect_ratios),
+            mean_length=float(np.mean(lengths)),
+            stddev_length=float(np.std(lengths)),
+            mean_width=float(np.mean(widths)),
+            stddev_width=float(np.std(widths)),
+            mean_aspect_ratio=float(np.mean(aspect_ratios)),
+            stddev_aspect_ratio=float(np.std(aspect_ratios)),
         )
     
     def filter_images(self, f: Callable[[Image], bool]) -> "Dataset":
@@ -176,6 +231,7 @@ class Dataset:
     
     @staticmethod
     def random_filter(images: List[Image], count: int) -> List[Image]:
+        import numpy as np
         return list(np.random.choice(images, count))
     
     def subset(self, method: str, by_dir: bool, count: int) -> "Dataset":
@@ -219,10 +275,12 @@ class Dataset:
             ds.annotations.extend(im.annotations)
         return ds
 
+    @profiling.timed('Dataset.copy_files')
     def copy_files(self, dn: str) -> "Dataset":
         if dn == self.root:
             return self
         
+        from tqdm import tqdm
         for image in tqdm(self.images, unit='images'):
             src = os.path.join(self.root, image.file_name)
             dest = os.path.join(dn, image.file_name)
@@ -231,28 +289,89 @@ class Dataset:
             shutil.copy(src, dest)
         return self
     
-    def union(self, *others: "Dataset", collision_strategy='error') -> "Dataset":
-        def update_imset(im: Image, imset: dict) -> Image:
-            fn = im.file_name
-            if fn in imset:
+    def export_masks(
+            self,
+            output_dir: str,
+            kinds=('semantic', 'instance'),
+            processes: int = None,
+            show_progress=True) -> "Dataset":
+        """
+        Write label images (16-bit if needed) for every image, to
+        $output_dir/<kind>/<file name>.png, for each of $kinds:
+         - 'semantic': pixels labelled with category id (ids must be positive),
+         - 'instance': pixels labelled with 1 + index of annotation in image.
+        Unlabelled pixels are 0. Images are drawn one at a time in each of
+        $processes worker processes (set to 1 to draw in this process), with
+        only a few images per process queued at once.
+        Raises ValueError if an image's file name is absolute or leads out of
+        $output_dir, or two images would share a label file (e.g. "x.jpg" and
+        "x.png").
+        """
+        from .export import export_masks
+        export_masks(self, output_dir, kinds, processes, show_progress)
+        return self
+
+    def union(
+            self,
+            *others: "Dataset",
+            collision_strategy='error',
+            dedup_iou=0.5,
+            dedup_iou_method=Annotation.IoUMethod.Box,
+            identify_by='name',
+            hash_workers: int = None) -> "Dataset":
+        """
+        Join $others into this dataset. Images are identified by $identify_by:
+        'name' (file name) or 'content' (hash of image file contents, computed
+        by $hash_workers threads), so the same image under different paths
+        is recognised. Images present in more than one dataset are handled
+        according to $collision_strategy:
+         - 'error': raise ValueError,
+         - 'merge': keep all annotations of the image,
+         - 'preserve': keep only the first dataset's annotations,
+         - 'nms' or 'average': merge annotations, then remove duplicates
+           (overlapping with IoU above $dedup_iou) as per deduplicate().
+        Images repeated within this dataset are not collisions: only the last
+        of them is kept.
+        """
+        if identify_by == 'name':
+            keys = [[image.file_name for image in ds.images] for ds in [self, *others]]
+        elif identify_by == 'content':
+            from ..hashing import file_digests
+            digests = iter(file_digests([
+                os.path.join(ds.root, image.file_name)
+                for ds in [self, *others]
+                for image in ds.images
+            ], hash_workers))
+            keys = [[next(digests) for _ in ds.images] for ds in [self, *others]]
+        else:
+            raise ValueError(f'Unknown image identity "{identify_by}" in union')
+
+        collided = set()
+
+        def update_imset(key: str, im: Image, imset: dict) -> Image:
+            if key in imset:
                 if collision_strategy == 'error':
-                    raise ValueError(f'Image {fn} present in two or more datasets')
-                elif collision_strategy == 'merge':
-                    imset[fn].annotations.extend(im.annotations)
+                    raise ValueError(f'Image {im.file_name} present in two or more datasets')
+                elif collision_strategy in {'merge', 'nms', 'average'}:
+                    imset[key].annotations.extend(im.annotations)
+                    collided.add(key)
                 elif collision_strategy == 'preserve':
                     pass
                 else:
                     raise ValueError(f'Unknown collision strategy "{collision_strategy}" in union')
             else:
-                imset[fn] = im
+                imset[key] = im
 
-        image_set = {
-            image.file_name: image
-            for image in self.images
-        }
-        for other in others:
-            for image in other.images:
-                update_imset(image, image_set)
+        image_set = dict(zip(keys[0], self.images))
+        for ds, ds_keys in zip(others, keys[1:]):
+            for key, image in zip(ds_keys, ds.images):
+                update_imset(key, image, image_set)
+
+        if collision_strategy in {'nms', 'average'}:
+            from .dedup import deduplicate
+            for key in collided:
+                image = image_set[key]
+                image.annotations = deduplicate(image.annotations, dedup_iou, dedup_iou_method, collision_strategy)
 
         self.images = list(image_set.values())
         self.annotations = []
@@ -260,5 +379,72 @@ class Dataset:
             im.set_id(i)
             self.annotations.extend(im.annotations)
         return self
-        
-        
+
+    def shard(self, count: int, method='hash') -> List["Dataset"]:
+        """
+        Split dataset into $count shards. Image, annotation and category IDs
+        are kept as they are, so shards can later be merged back together.
+
+        Images are assigned to shards by $method:
+         - 'hash': by hash of base file name (stable across runs and machines,
+           and the same for truth and predictions whatever their directories),
+         - 'dir': by directory, keeping directories whole and balancing image count,
+         - 'count': into contiguous runs of (near) equal numbers of images.
+        """
+        if count < 1:
+            raise ValueError(f'Number of shards must be positive, got {count}.')
+        for kind, items in [('image', self.images), ('annotation', self.annotations), ('category', self.categories)]:
+            ids = [item.id for item in items]
+            if len(set(ids)) != len(ids):
+                raise ValueError(f'Duplicate {kind} IDs: IDs must be unique to shard dataset.')
+
+        shard_images = [[] for _ in range(count)]
+        if method == 'hash':
+            for im in self.images:
+                shard_images[zlib.crc32(im.base_name.encode()) % count].append(im)
+        elif method == 'dir':
+            images_by_dir = defaultdict(list)
+            for im in self.images:
+                images_by_dir[os.path.dirname(im.file_name)].append(im)
+            # biggest directories first, each into the emptiest shard
+            for d in sorted(images_by_dir, key=lambda d: (-len(images_by_dir[d]), d)):
+                emptiest = min(range(count), key=lambda i: len(shard_images[i]))
+                shard_images[emptiest].extend(images_by_dir[d])
+        elif method == 'count':
+            for i, im in enumerate(self.images):
+                shard_images[i*count // len(self.images)].append(im)
+        else:
+            raise ValueError(f'Unknown shard method "{method}".')
+
+        shards = []
+        for i, images in enumerate(shard_images):
+            annotations = [ann for im in images for ann in im.annotations]
+            extra = dict(self.extra, shard=dict(index=i, count=count, method=method))
+            shards.append(Dataset(images, self.categories, annotations, self.root, **extra))
+        return shards
+
+    @classmethod
+    def merge(cls, shards: List["Dataset"]) -> "Dataset":
+        """
+        Reassemble shards (see shard()) into one dataset, ordered by image
+        and annotation ID. IDs must not clash between shards.
+        """
+        if not shards:
+            raise ValueError('No shards to merge.')
+
+        categories = {}
+        for shard in shards:
+            for cat in shard.categories:
+                if cat.id in categories and categories[cat.id].name != cat.name:
+                    raise ValueError(f'Category {cat.id} is "{categories[cat.id].name}" in one shard but "{cat.name}" in another.')
+                categories.setdefault(cat.id, cat)
+
+        images = sorted([im for shard in shards for im in shard.images], key=lambda im: im.id)
+        annotations = sorted([ann for shard in shards for ann in shard.annotations], key=lambda ann: ann.id)
+        for kind, items in [('image', images), ('annotation', annotations)]:
+            ids = [item.id for item in items]
+            if len(set(ids)) != len(ids):
+                raise ValueError(f'Duplicate {kind} IDs in shards.')
+
+        extra = {k: v for k, v in shards[0].extra.items() if k != 'shard'}
+        return cls(images, sorted(categories.values(), key=lambda c: c.id), annotations, shards[0].root, **extra)
@@ -0,0 +1,107 @@
+from typing import List
+
+import numpy as np
+
+from .annotation import Annotation
+from .iou import iou_matrix, boxes_of
+from .. import profiling
+
+
+DEDUP_METHODS = {'nms', 'average'}
+
+
+# extra fields describing the shape itself, which do not hold for a voted shape
+SHAPE_FIELDS = {'area', 'bbox'}
+
+
+def _vote(cluster: List[Annotation], weights: np.ndarray) -> Annotation:
+    """
+    Annotation covering pixels in more than half (by $weights) of the masks
+    of $cluster, or the first of $cluster if there are none. Masks are drawn
+    only over the cluster's bounding box, clipped to the image if its size is
+    known.
+    """
+    import cv2
+
+    top = cluster[0]
+    boxes = boxes_of(cluster).astype(np.int64)
+    x1, y1 = boxes[:, :2].min(axis=0)
+    x2, y2 = boxes[:, 2:].max(axis=0) + 1
+    if top.image_size is not None:
+        width, height = top.image_size
+        x1, y1 = max(x1, 0), max(y1, 0)
+        x2, y2 = min(x2, width), min(y2, height)
+    if x2 <= x1 or y2 <= y1:
+        return top
+
+    votes = np.zeros((y2 - y1, x2 - x1), np.float64)
+    for ann, w in zip(cluster, weights):
+        mask = np.zeros(votes.shape, np.uint8)
+        cv2.drawContours(mask, [ann.contour - np.array([x1, y1], np.int32)], -1, 1, -1)
+        votes += w*mask
+    mask = (votes > 0.5*weights.sum()).astype(np.uint8)
+
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return top
+    contour = max(contours, key=cv2.contourArea) + np.array([x1, y1], np.int32)
+    extra = {k: v for k, v in top.extra.items() if k not in SHAPE_FIELDS}
+    voted = Annotation.from_contour(contour, top.category_id, score=top.score, **extra)
+    voted.id, voted.image_id = top.id, top.image_id
+    if top.image_size is not None:
+        voted.compute_bbox(*top.image_size)
+    return voted
+
+
+@profiling.timed('deduplicate')
+def deduplicate(
+        annotations: List[Annotation],
+        iou_thresh=0.5,
+        iou_method=Annotation.IoUMethod.Box,
+        method='nms',
+        class_agnostic=False,
+) -> List[Annotation]:
+    """
+    Remove duplicates from $annotations (of a single image): annotations of
+    the same category overlapping with IoU above $iou_thresh.
+
+    Annotations are taken in descending order of score (annotations without
+    score count as score 1); each suppresses the not yet suppressed
+    annotations it overlaps. With $method 'nms' the suppressing annotation is
+    kept as it is, with 'average' it is replaced by a score-weighted vote of
+    its own and the suppressed annotations' masks.
+    """
+    if method not in DEDUP_METHODS:
+        raise ValueError(f'Unknown deduplication method "{method}", expected one of {DEDUP_METHODS}.')
+    if len(annotations) < 2:
+        return list(annotations)
+
+    scores = np.array([1.0 if ann.score is None else ann.score for ann in annotations], np.float64)
+    order = np.argsort(-scores, kind='stable')
+    annotations = [annotations[i] for i in order]
+    scores = scores[order]
+
+    overlapping = iou_matrix(annotations, annotations, iou_method) > iou_thresh
+    if not class_agnostic:
+        categories = np.array([ann.category_id for ann in annotations])
+        overlapping &= categories[:, None] == categories[None, :]
+
+    n = len(annotations)
+    keep = np.ones(n, bool)
+    owner = np.arange(n)
+    for i in range(n):
+        if not keep[i]:
+            continue
+        suppressed = overlapping[i, i + 1:] & keep[i + 1:]
+        keep[i + 1:] &= ~suppressed
+        owner[i + 1:][suppressed] = i
+    profiling.count('duplicates removed', n - int(np.count_nonzero(keep)))
+
+    kept = []
+    for i in np.nonzero(keep)[0]:
+        members = np.nonzero(owner == i)[0]
+        if method == 'average' and len(members) > 1:
+            kept.append(_vote([annotations[j] for j in members], scores[members]))
+        else:
+            kept.append(annotations[i])
+    return kept
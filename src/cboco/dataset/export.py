@@ -0,0 +1,117 @@
+from typing import Iterator, List, Optional, Tuple
+from collections import deque
+import os
+
+import numpy as np
+import cv2
+
+from .. import profiling
+
+
+MASK_KINDS = {'semantic', 'instance'}
+
+
+def label_path(output_dir: str, kind: str, file_name: str) -> str:
+    """
+    Where the $kind label image of image $file_name is written. Raises
+    ValueError if $file_name is absolute or leads out of $output_dir.
+    """
+    relative = os.path.normpath(file_name)
+    if os.path.isabs(relative) or relative.split(os.sep)[0] == os.pardir:
+        raise ValueError(f'Cannot write labels of image "{file_name}" outside the output directory.')
+    return os.path.join(output_dir, kind, os.path.splitext(relative)[0] + '.png')
+
+
+def draw_labels(width: int, height: int, segmentations: List[List[List[int]]], values: List[int]) -> np.ndarray:
+    """
+    Label image of size $width x $height with each of $segmentations filled
+    with the corresponding value of $values. Later annotations are drawn
+    over earlier ones; unlabelled pixels are 0.
+    """
+    dtype = np.uint8 if max(values, default=0) < 256 else np.uint16
+    assert max(values, default=0) < 65536, 'Too many labels for 16-bit PNG.'
+    labels = np.zeros((height, width), dtype)
+    for seg, value in zip(segmentations, values):
+        if not seg:
+            continue
+        # drawn as Annotation.draw_mask does, so labels agree with masks
+        contour = np.array([v for poly in seg for v in poly]).reshape(-1, 1, 2).astype(np.int32)
+        cv2.drawContours(labels, [contour], -1, int(value), -1)
+    return labels
+
+
+def export_image(args: Tuple[str, str, int, int, List[int], List[List[List[int]]], List[str]]) -> str:
+    """Draw and write label images for one image. Run in worker processes."""
+    output_dir, file_name, width, height, category_ids, segmentations, kinds = args
+    for kind in kinds:
+        if kind == 'semantic':
+            labels = draw_labels(width, height, segmentations, category_ids)
+        else:
+            labels = draw_labels(width, height, segmentations, list(range(1, len(segmentations) + 1)))
+        fn = label_path(output_dir, kind, file_name)
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        if not cv2.imwrite(fn, labels):
+            raise IOError(f'Could not write "{fn}".')
+    return file_name
+
+
+@profiling.timed('export_masks')
+def export_masks(dataset, output_dir: str, kinds=('semantic', 'instance'), processes: int = None, show_progress=True):
+    """See Dataset.export_masks."""
+    unknown = set(kinds) - MASK_KINDS
+    if unknown:
+        raise ValueError(f'Unknown mask kinds {unknown}, expected some of {MASK_KINDS}.')
+    if 'semantic' in kinds:
+        # 0 is background in semantic labels
+        unlabelled = sorted({ann.category_id for ann in dataset.annotations if ann.category_id < 1})
+        if unlabelled:
+            raise ValueError(f'Category ids must be positive for semantic labels, got {unlabelled}.')
+    # checked up front, so nothing is written for a dataset that can't be exported
+    written = {}
+    for image in dataset.images:
+        fn = label_path(output_dir, 'semantic', image.file_name)
+        if fn in written:
+            raise ValueError(f'Images "{written[fn]}" and "{image.file_name}" would have the same label file.')
+        written[fn] = image.file_name
+
+    # only plain lists are sent to workers, one image at a time
+    jobs = (
+        (
+            output_dir, image.file_name, image.width, image.height,
+            [ann.category_id for ann in image.annotations],
+            [ann.segmentation for ann in image.annotations],
+            list(kinds),
+        )
+        for image in dataset.images
+    )
+    done = map(export_image, jobs) if processes == 1 else _export_in_pool(jobs, processes)
+
+    if show_progress:
+        from tqdm import tqdm
+        done = tqdm(done, total=len(dataset.images), unit='images')
+    for _ in done:
+        profiling.count('label images exported')
+
+
+def _export_in_pool(jobs: Iterator[tuple], processes: Optional[int]) -> Iterator[str]:
+    """
+    Run export_image() on $jobs in $processes worker processes, yielding file
+    names in order. Only a couple of jobs per worker are submitted at a time,
+    so only those images' annotations are held waiting.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    processes = processes or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        max_pending = 2*processes
+        pending = deque()
+        try:
+            for job in jobs:
+                pending.append(pool.submit(export_image, job))
+                if len(pending) >= max_pending:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
@@ -1,6 +1,3 @@
-import numpy as np
-import cv2
-
 class Image:
 
     def __init__(
@@ -18,12 +15,18 @@ class Image:
         self.height = height
         self.extra = extra
         self.annotations = []
-        fn_parts = self.file_name.split('/')
-        self.base_name = fn_parts[-1]
-        self.hashable_name = '/'.join(fn_parts[-3:])
+        self.base_name = self.file_name.split('/')[-1]
+        self.hashable_name = self.get_hashable_name(self.file_name)
+    
+    @staticmethod
+    def get_hashable_name(file_name: str) -> str:
+        """Name used to identify an image: the last three components of its path."""
+        fn_parts = file_name.replace('\\', '/').split('/')
+        return '/'.join(fn_parts[-3:])
     
     @classmethod
     def from_file(cls, file_name: str, **extra) -> "Image":
+        import cv2
         img = cv2.imread(file_name, cv2.IMREAD_GRAYSCALE)
         if img is None:
             raise IOError(f'Could not read image "{file_name}".')
@@ -0,0 +1,82 @@
+from typing import List
+
+import numpy as np
+
+from .annotation import Annotation
+from .. import profiling
+
+
+def boxes_of(annotations: List[Annotation]) -> np.ndarray:
+    """Stack (x1, y1, x2, y2) boxes of $annotations into an (N, 4) array."""
+    if not annotations:
+        return np.zeros((0, 4), np.float64)
+    return np.array([ann.bbox for ann in annotations], np.float64)
+
+
+def areas_of(annotations: List[Annotation], method=Annotation.IoUMethod.Box) -> np.ndarray:
+    """Areas of $annotations' boxes or masks, depending on $method."""
+    if method == Annotation.IoUMethod.Mask:
+        return np.array([np.count_nonzero(ann.mask) for ann in annotations], np.float64)
+    boxes = boxes_of(annotations)
+    return (boxes[:, 2] - boxes[:, 0])*(boxes[:, 3] - boxes[:, 1])
+
+
+def box_iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Calculate IoU between every pair of boxes in (N, 4) array $a and (M, 4)
+    array $b. Returns (N, M) array.
+    """
+    a = a[:, None, :]
+    b = b[None, :, :]
+    iw = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    ih = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    intersection = iw*ih
+    a_area = (a[..., 2] - a[..., 0])*(a[..., 3] - a[..., 1])
+    b_area = (b[..., 2] - b[..., 0])*(b[..., 3] - b[..., 1])
+    union = a_area + b_area - intersection
+    with np.errstate(divide='ignore', invalid='ignore'):
+        iou = np.where(union > 0, intersection / union, 0.0)
+    return iou
+
+
+def mask_iou_matrix(a: List[Annotation], b: List[Annotation]) -> np.ndarray:
+    """
+    Calculate mask IoU between every pair of annotations in $a and $b.
+
+    Intersections are only counted for pairs whose boxes overlap, and then
+    only within the overlapping region. Returns (N, M) array.
+    """
+    ious = np.zeros((len(a), len(b)), np.float64)
+    if not a or not b:
+        return ious
+
+    a_boxes, b_boxes = boxes_of(a), boxes_of(b)
+    a_areas = areas_of(a, Annotation.IoUMethod.Mask)
+    b_areas = areas_of(b, Annotation.IoUMethod.Mask)
+
+    # box corners are inclusive pixel coords
+    x1 = np.maximum(a_boxes[:, None, 0], b_boxes[None, :, 0])
+    y1 = np.maximum(a_boxes[:, None, 1], b_boxes[None, :, 1])
+    x2 = np.minimum(a_boxes[:, None, 2], b_boxes[None, :, 2])
+    y2 = np.minimum(a_boxes[:, None, 3], b_boxes[None, :, 3])
+    for i, j in zip(*np.nonzero((x1 <= x2) & (y1 <= y2))):
+        ys = slice(max(int(y1[i, j]), 0), int(y2[i, j]) + 1)
+        xs = slice(max(int(x1[i, j]), 0), int(x2[i, j]) + 1)
+        intersection = np.count_nonzero(a[i].mask[ys, xs] & b[j].mask[ys, xs])
+        union = a_areas[i] + b_areas[j] - intersection
+        if union > 0:
+            ious[i, j] = intersection / union
+    return ious
+
+
+@profiling.timed('iou_matrix')
+def iou_matrix(a: List[Annotation], b: List[Annotation], method=Annotation.IoUMethod.Box) -> np.ndarray:
+    """Calculate IoU between every pair of annotations in $a and $b using $method."""
+    if not isinstance(method, Annotation.IoUMethod):
+        raise ValueError(f'Unknown IoU method "{method}", expected instance of {Annotation.IoUMethod}.')
+    if method == Annotation.IoUMethod.Box:
+        return box_iou_matrix(boxes_of(a), boxes_of(b))
+    elif method == Annotation.IoUMethod.Mask:
+        return mask_iou_matrix(a, b)
+    else:
+        raise ValueError(f'Unknown IoU method "{method}".')
@@ -0,0 +1,43 @@
+from typing import Iterable, Iterator, Tuple
+from collections import deque
+
+from .dataset import Dataset
+
+
+def iter_datasets(fns: Iterable[str], prefetch: int = 2) -> Iterator[Tuple[str, Dataset]]:
+    """
+    Load datasets from json files $fns, yielding (filename, dataset) in order.
+
+    Up to $prefetch datasets are parsed in the background while the caller
+    works on the current one, so at most $prefetch + 1 datasets are held in
+    memory at any time. Set $prefetch to 0 to load sequentially.
+    """
+    fns = iter(fns)
+    if prefetch < 1:
+        for fn in fns:
+            yield fn, Dataset.from_json(fn)
+        return
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=prefetch) as pool:
+        pending = deque()
+        try:
+            for _ in range(prefetch):
+                fn = next(fns, None)
+                if fn is None:
+                    break
+                pending.append((fn, pool.submit(Dataset.from_json, fn)))
+
+            while pending:
+                fn, future = pending.popleft()
+                ds = future.result()
+
+                # queue up next load before handing this one over
+                next_fn = next(fns, None)
+                if next_fn is not None:
+                    pending.append((next_fn, pool.submit(Dataset.from_json, next_fn)))
+
+                yield fn, ds
+        finally:
+            for _, future in pending:
+                future.cancel()
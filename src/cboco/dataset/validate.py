@@ -0,0 +1,198 @@
+from typing import List, Optional, Tuple
+from dataclasses import dataclass
+import numbers
+import json
+import os
+
+import numpy as np
+
+from .. import profiling
+
+
+@dataclass
+class Problem:
+    # kind of problem, e.g. "duplicate annotation id"
+    kind: str
+    message: str
+
+
+def _duplicates(kind: str, items: list) -> List[Problem]:
+    ids = np.array([item.get('id', -1) for item in items])
+    unique, counts = np.unique(ids, return_counts=True)
+    return [
+        Problem(f'duplicate {kind} id', f'{kind.capitalize()} id {i} used {n} times.')
+        for i, n in zip(unique[counts > 1].tolist(), counts[counts > 1].tolist())
+    ]
+
+
+def _check_references(images: list, categories: list, annotations: list) -> List[Problem]:
+    problems = []
+    image_ids = np.array([im.get('id', -1) for im in images])
+    category_ids = np.array([cat.get('id', -1) for cat in categories])
+    ann_ids = np.array([ann.get('id', -1) for ann in annotations])
+    ann_image_ids = np.array([ann.get('image_id', -1) for ann in annotations])
+    ann_category_ids = np.array([ann.get('category_id', -1) for ann in annotations])
+    for i in np.nonzero(~np.isin(ann_image_ids, image_ids))[0]:
+        problems.append(Problem('orphan annotation', f'Annotation {ann_ids[i]} refers to missing image {ann_image_ids[i]}.'))
+    for i in np.nonzero(~np.isin(ann_category_ids, category_ids))[0]:
+        problems.append(Problem('unknown category', f'Annotation {ann_ids[i]} has unknown category {ann_category_ids[i]}.'))
+    return problems
+
+
+def _is_number(v) -> bool:
+    return isinstance(v, numbers.Real) and not isinstance(v, bool)
+
+
+def _image_size(image: dict) -> Optional[Tuple[float, float]]:
+    """Width and height of $image, or None if either is missing or not a number."""
+    w, h = image.get('width'), image.get('height')
+    return (w, h) if _is_number(w) and _is_number(h) else None
+
+
+def _check_sizes(images: list) -> List[Problem]:
+    problems = []
+    for im in images:
+        if _image_size(im) is None:
+            kind = 'missing size' if im.get('width') is None or im.get('height') is None else 'invalid size'
+            problems.append(Problem(kind, f'Image {im.get("id")} has width {im.get("width")!r} and height {im.get("height")!r}.'))
+    return problems
+
+
+def _check_polygons(images: list, annotations: list) -> List[Problem]:
+    """Degenerate and out-of-bounds polygons, checked for all annotations at once."""
+    problems = []
+    ann_ids = [ann.get('id', -1) for ann in annotations]
+
+    # only polygon segmentations are supported, not RLE (dicts)
+    is_rle = np.array([isinstance(ann.get('segmentation'), dict) for ann in annotations], bool)
+    for i in np.nonzero(is_rle)[0]:
+        problems.append(Problem('unsupported segmentation', f'Annotation {ann_ids[i]} has an RLE segmentation; only polygons are supported.'))
+
+    # a list of polygons, each a list of numbers
+    is_valid = ~is_rle
+    for i in np.nonzero(is_valid)[0]:
+        seg = annotations[i].get('segmentation') or []
+        if not isinstance(seg, (list, tuple)) or not all(
+                isinstance(poly, (list, tuple)) and all(_is_number(v) for v in poly) for poly in seg):
+            is_valid[i] = False
+            problems.append(Problem('invalid segmentation', f'Annotation {ann_ids[i]} segmentation is not a list of lists of numbers.'))
+
+    # polygon-level arrays: length and owning annotation
+    polygons = [
+        (i, poly)
+        for i, ann in enumerate(annotations) if is_valid[i]
+        for poly in (ann.get('segmentation') or [])
+    ]
+    has_polygon = ~is_valid
+    has_polygon[[i for i, _ in polygons]] = True
+    for i in np.nonzero(~has_polygon)[0]:
+        problems.append(Problem('empty segmentation', f'Annotation {ann_ids[i]} has no polygons.'))
+
+    lengths = np.array([len(poly) for _, poly in polygons], np.int64)
+    owner = np.array([i for i, _ in polygons], np.int64)
+    bad = (lengths % 2 == 1) | (lengths < 6)
+    for i in np.unique(owner[bad]):
+        problems.append(Problem('degenerate polygon', f'Annotation {ann_ids[i]} has a polygon with fewer than 3 points (or an odd number of coordinates).'))
+    polygons = [poly for (_, poly), b in zip(polygons, bad) if not b]
+    lengths, owner = lengths[~bad], owner[~bad]
+    if not polygons:
+        return problems
+
+    coords = np.array([v for poly in polygons for v in poly], np.float64).reshape(-1, 2)
+    counts = lengths // 2
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    point_owner = np.repeat(owner, counts)
+    finite = np.isfinite(coords).all(axis=1)
+    for i in np.unique(point_owner[~finite]):
+        problems.append(Problem('invalid segmentation', f'Annotation {ann_ids[i]} has non-finite coordinates.'))
+    # masks are drawn from coordinates truncated to int, so check those too
+    coords = np.where(finite[:, None], coords, 0)
+    xs, ys = coords[:, 0], coords[:, 1]
+    ixs, iys = np.trunc(xs), np.trunc(ys)
+
+    # shoelace area of each polygon: next point wraps round within its polygon
+    nxt = np.arange(len(xs)) + 1
+    nxt[starts + counts - 1] = starts
+    areas = np.abs(np.add.reduceat(xs*ys[nxt] - xs[nxt]*ys, starts))/2
+    int_areas = np.abs(np.add.reduceat(ixs*iys[nxt] - ixs[nxt]*iys, starts))/2
+    finite_polygon = np.logical_and.reduceat(finite, starts)
+    for i in np.unique(owner[finite_polygon & ((areas == 0) | (int_areas == 0))]):
+        problems.append(Problem('degenerate polygon', f'Annotation {ann_ids[i]} has a polygon of zero area.'))
+
+    # extent of each annotation (points of an annotation are contiguous)
+    ann_starts = np.nonzero(np.r_[True, point_owner[1:] != point_owner[:-1]])[0]
+    anns = point_owner[ann_starts]
+    finite_ann = np.logical_and.reduceat(finite, ann_starts)
+    x1, x2 = np.minimum.reduceat(xs, ann_starts), np.maximum.reduceat(xs, ann_starts)
+    y1, y2 = np.minimum.reduceat(ys, ann_starts), np.maximum.reduceat(ys, ann_starts)
+    # truncation keeps order, so the truncated extent is that of truncated points
+    flat = (np.trunc(x1) == np.trunc(x2)) | (np.trunc(y1) == np.trunc(y2))
+    for i in anns[finite_ann & flat]:
+        problems.append(Problem('degenerate box', f'Annotation {ann_ids[i]} has zero width or height.'))
+
+    # images without a valid size are reported by _check_sizes, not here;
+    # truncation (towards zero) can't take a point outside the image
+    sizes = {im.get('id'): _image_size(im) or (np.inf, np.inf) for im in images}
+    wh = np.array([sizes.get(annotations[i].get('image_id'), (np.inf, np.inf)) for i in anns], np.float64).reshape(-1, 2)
+    outside = (x1 < 0) | (y1 < 0) | (x2 > wh[:, 0]) | (y2 > wh[:, 1])
+    for i in anns[finite_ann & outside]:
+        problems.append(Problem('out of bounds', f'Annotation {ann_ids[i]} extends outside its image.'))
+    return problems
+
+
+def _check_file(args) -> Optional[Problem]:
+    fn, width, height, check_size = args
+    if not os.path.isfile(fn):
+        return Problem('missing file', f'Image file "{fn}" not found.')
+    if check_size:
+        import cv2
+        img = cv2.imread(fn, cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            return Problem('unreadable file', f'Image file "{fn}" could not be read.')
+        if img.shape != (height, width):
+            return Problem('size mismatch', f'Image file "{fn}" is {img.shape[1]}x{img.shape[0]}, dataset says {width}x{height}.')
+    return None
+
+
+def _check_files(images: list, root: str, check_size: bool, workers: Optional[int]) -> List[Problem]:
+    from concurrent.futures import ThreadPoolExecutor
+    jobs = [
+        (os.path.join(root, im.get('file_name', '')), im.get('width'), im.get('height'), check_size and _image_size(im) is not None)
+        for im in images
+    ]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return [p for p in pool.map(_check_file, jobs) if p is not None]
+
+
+@profiling.timed('validate')
+def validate(data: dict, root='.', check_files=True, check_size=True, workers: Optional[int] = None) -> List[Problem]:
+    """
+    Find all problems with COCO-format dataset dict $data: duplicate ids,
+    annotations of missing images or categories, missing image sizes,
+    malformed, empty, degenerate and out of bounds polygons, and (if
+    $check_files) image files missing from $root or (if $check_size) of a
+    different size to that recorded. Files are checked by $workers threads.
+    """
+    missing = [k for k in ('images', 'categories', 'annotations') if k not in data]
+    if missing:
+        return [Problem('missing key', f'Dataset has no "{k}".') for k in missing]
+    images, categories, annotations = data['images'], data['categories'], data['annotations']
+
+    problems = []
+    for kind, items in [('image', images), ('category', categories), ('annotation', annotations)]:
+        problems.extend(_duplicates(kind, items))
+    problems.extend(_check_references(images, categories, annotations))
+    problems.extend(_check_sizes(images))
+    with profiling.timer('validate: polygons'):
+        problems.extend(_check_polygons(images, annotations))
+    if check_files:
+        with profiling.timer('validate: files'):
+            problems.extend(_check_files(images, root, check_size, workers))
+    return problems
+
+
+def validate_json(fn: str, **kwargs) -> List[Problem]:
+    """Problems with dataset in json file $fn; see validate()."""
+    with open(fn) as f:
+        data = json.load(f)
+    return validate(data, root=os.path.dirname(fn), **kwargs)
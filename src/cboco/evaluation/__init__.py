@@ -1 +1,7 @@
-from .evaluate_dataset import evaluate_dataset
+from .evaluate_dataset import evaluate_dataset, accumulate_dataset, dataset_overlaps, accumulate_overlaps
+from .breakdown import evaluate_dataset_breakdown, breakdown_metrics, Breakdown, AREA_RANGES
+from .bootstrap import bootstrap_intervals, bootstrap_metrics
+from .online import OnlineEvaluator
+from .accumulate import Accumulator
+from .cache import ResultCache, cached_accumulate
+from .curves import pr_curves, save_curves
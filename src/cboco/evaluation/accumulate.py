@@ -0,0 +1,361 @@
+from typing import Dict, Hashable, List, Optional, Tuple
+from dataclasses import fields
+
+import numpy as np
+
+from .evaluate_image import ImageEvaluation
+from .ap import calculate_AP_from_arrays, calculate_AP_from_ranked, precision_at_recall
+from .. import profiling
+
+
+class Accumulator:
+    """
+    Running tally of per-image evaluation results, from which metrics can
+    be reported at any time.
+
+    Images are keyed so that re-adding an image replaces its old result.
+
+    Predictions of all images are kept in rank order for AP between reports;
+    those of images added since the last report are merged in, rather than
+    all being sorted again. Replacing, removing or reordering images means
+    sorting again at the next report.
+    """
+
+    def __init__(self, iou_thresh: List[float], sort_by_iou=False):
+        self.iou_thresh = list(iou_thresh)
+        self.sort_by_iou = sort_by_iou
+        self.evaluations: Dict[Hashable, ImageEvaluation] = {}
+        self.num_matches = np.zeros(len(self.iou_thresh), np.int64)
+        self.num_preds = 0
+        self.num_truth = 0
+        # (T, P) rank (descending) and TP flags of predictions in rank order,
+        # as of the last report, and results added since
+        self._ranked: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self._pending: List[ImageEvaluation] = []
+
+    def __len__(self) -> int:
+        return len(self.evaluations)
+
+    def add(self, key: Hashable, evaluation: ImageEvaluation):
+        """Add result of image $key, replacing (in place) any earlier result."""
+        assert evaluation.pred_is_tp.shape[0] == len(self.iou_thresh)
+        old = self.evaluations.get(key)
+        if old is not None:
+            self.num_matches -= old.num_matches
+            self.num_preds -= old.num_preds
+            self.num_truth -= old.num_truth
+            self._forget_ranked()
+        elif self._ranked is not None:
+            self._pending.append(evaluation)
+        self.evaluations[key] = evaluation
+        self.num_matches += evaluation.num_matches
+        self.num_preds += evaluation.num_preds
+        self.num_truth += evaluation.num_truth
+
+    def remove(self, key: Hashable):
+        evaluation = self.evaluations.pop(key, None)
+        if evaluation is not None:
+            self.num_matches -= evaluation.num_matches
+            self.num_preds -= evaluation.num_preds
+            self.num_truth -= evaluation.num_truth
+            self._forget_ranked()
+
+    @classmethod
+    def merge(cls, accumulators: List["Accumulator"]) -> "Accumulator":
+        """
+        Combine accumulators of disjoint sets of images (e.g. from shards of
+        a dataset) into one, with images sorted as per sort().
+        """
+        if not accumulators:
+            raise ValueError('Nothing to merge: need at least one accumulator.')
+        first = accumulators[0]
+        evaluations = {}
+        for accumulator in accumulators:
+            if accumulator.iou_thresh != first.iou_thresh or accumulator.sort_by_iou != first.sort_by_iou:
+                raise ValueError('Cannot merge results evaluated with different settings.')
+            evaluations.update(accumulator.evaluations)
+
+        merged = cls(first.iou_thresh, first.sort_by_iou)
+        for key, evaluation in evaluations.items():
+            merged.add(key, evaluation)
+        merged.sort()
+        return merged
+
+    def sort(self):
+        """
+        Put images in order of base name, as when evaluating a whole dataset
+        at once, so that ties in score are ranked the same way.
+        """
+        keys = sorted(self.evaluations, key=lambda k: (str(k).split('/')[-1], str(k)))
+        if keys != list(self.evaluations):
+            self.evaluations = {k: self.evaluations[k] for k in keys}
+            self._forget_ranked()
+
+    def save(self, fn: str, **extra: np.ndarray):
+        """
+        Write per-image results to compressed numpy archive $fn. Image keys
+        are stored as strings. Any $extra arrays are stored alongside.
+        """
+        evaluations = list(self.evaluations.values())
+        arrays = {}
+        for field in fields(ImageEvaluation):
+            # per-image arrays are joined along their last (annotation) axis
+            per_image = [getattr(e, field.name) for e in evaluations]
+            if any(v is None for v in per_image):
+                # optional results, kept only if present for every image
+                continue
+            arrays[field.name] = np.concatenate(per_image, axis=per_image[0].ndim - 1) if per_image else np.zeros(0)
+        np.savez_compressed(
+            fn,
+            keys=np.array([str(k) for k in self.evaluations], dtype=str),
+            num_preds=np.array([e.num_preds for e in evaluations], np.int64),
+            num_truth=np.array([e.num_truth for e in evaluations], np.int64),
+            iou_thresh=np.array(self.iou_thresh, np.float64),
+            sort_by_iou=np.array(self.sort_by_iou),
+            **arrays,
+            **extra,
+        )
+
+    @classmethod
+    def load(cls, fn: str) -> "Accumulator":
+        """Read per-image results written by save()."""
+        with np.load(fn) as data:
+            accumulator = cls(list(data['iou_thresh']), bool(data['sort_by_iou']))
+            pred_splits = np.cumsum(data['num_preds'])[:-1]
+            truth_splits = np.cumsum(data['num_truth'])[:-1]
+            per_image = {}
+            for field in fields(ImageEvaluation):
+                if field.name not in data:
+                    continue
+                arr = data[field.name]
+                splits = truth_splits if field.name.startswith('truth') else pred_splits
+                per_image[field.name] = np.split(arr, splits, axis=arr.ndim - 1)
+            for i, key in enumerate(data['keys']):
+                accumulator.add(str(key), ImageEvaluation(**{k: v[i] for k, v in per_image.items()}))
+        return accumulator
+
+    def should_calc_AP(self) -> bool:
+        if self.sort_by_iou:
+            return True
+        for evaluation in self.evaluations.values():
+            if evaluation.num_preds:
+                first = evaluation.scores[0]
+                return bool(first) and not np.isnan(first)
+        return False
+
+    def concatenated(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Per-prediction scores, TP flags and IoUs of all images, in order of addition."""
+        n_thresh = len(self.iou_thresh)
+        evaluations = list(self.evaluations.values())
+        scores = np.concatenate([np.zeros(0), *[e.scores for e in evaluations]])
+        pred_is_tp = np.concatenate([np.zeros((n_thresh, 0), bool), *[e.pred_is_tp for e in evaluations]], axis=1)
+        pred_iou = np.concatenate([np.zeros((n_thresh, 0)), *[e.pred_iou for e in evaluations]], axis=1)
+        return scores, pred_is_tp, pred_iou
+
+    def _rank(self, evaluations: List[ImageEvaluation]) -> Tuple[np.ndarray, np.ndarray]:
+        """(T, P) rank and TP flags of predictions of $evaluations, in rank order."""
+        n_thresh = len(self.iou_thresh)
+        scores = np.concatenate([np.zeros(0), *[e.scores for e in evaluations]])
+        pred_is_tp = np.concatenate([np.zeros((n_thresh, 0), bool), *[e.pred_is_tp for e in evaluations]], axis=1)
+        if self.sort_by_iou:
+            rank = np.concatenate([np.zeros((n_thresh, 0)), *[e.pred_iou for e in evaluations]], axis=1)
+        else:
+            rank = np.broadcast_to(scores, pred_is_tp.shape)
+        order = np.argsort(-rank, axis=1, kind='stable')
+        return np.take_along_axis(rank, order, axis=1), np.take_along_axis(pred_is_tp, order, axis=1)
+
+    def _forget_ranked(self):
+        self._ranked = None
+        self._pending = []
+
+    @profiling.timed('Accumulator.ranked')
+    def ranked(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (T, P) rank (descending) and TP flags of all predictions in rank order
+        at each threshold, ties in order of addition. Predictions of images
+        added since the last call are merged into the previous result.
+        """
+        if self._ranked is None:
+            self._ranked = self._rank(list(self.evaluations.values()))
+        elif self._pending:
+            rank, is_tp = self._ranked
+            new_rank, new_is_tp = self._rank(self._pending)
+            # new predictions go after existing ones of equal rank
+            at = [np.searchsorted(-r, -n, side='right') for r, n in zip(rank, new_rank)]
+            self._ranked = (
+                np.stack([np.insert(r, i, n) for r, i, n in zip(rank, at, new_rank)]),
+                np.stack([np.insert(t, i, n) for t, i, n in zip(is_tp, at, new_is_tp)]),
+            )
+            profiling.count('ranked predictions merged', new_rank.shape[1])
+        self._pending = []
+        return self._ranked
+
+    def confusion_matrix(self, category_ids: List[int]) -> np.ndarray:
+        """
+        Confusion of categories at each threshold, from predictions matched
+        regardless of category (requires evaluation with confusion=True).
+
+        Returns (T, C+1, C+1) array counting truths of category $category_ids[i]
+        matched to predictions of category $category_ids[j] at [:, i, j]. Index
+        C is background: [:, i, C] counts unmatched truths, [:, C, j]
+        predictions matched to no truth. Each truth is counted once; with
+        legacy matching a prediction taken by several truths is counted with
+        each of them.
+        """
+        evaluations = list(self.evaluations.values())
+        if any(e.truth_agnostic_match is None for e in evaluations):
+            raise ValueError('Confusion matrix needs results evaluated with confusion=True.')
+
+        n_thresh, n_cat = len(self.iou_thresh), len(category_ids)
+        lookup = {c: i for i, c in enumerate(category_ids)}
+
+        def index_of(categories: np.ndarray) -> np.ndarray:
+            unique, inverse = np.unique(categories, return_inverse=True)
+            missing = set(unique.tolist()) - set(lookup)
+            if missing:
+                raise ValueError(f'Categories {missing} not in {category_ids}.')
+            return np.array([lookup[c] for c in unique.tolist()], np.int64)[inverse]
+
+        truth_index = index_of(np.concatenate([np.zeros(0, np.int64), *[e.truth_category for e in evaluations]]))
+        pred_index = index_of(np.concatenate([np.zeros(0, np.int64), *[e.pred_category for e in evaluations]]))
+        # offset matches from per-image to overall prediction indices
+        offsets = np.cumsum([0, *[e.num_preds for e in evaluations]])[:-1]
+        match = np.concatenate([np.zeros((n_thresh, 0), np.int64), *[
+            np.where(e.truth_agnostic_match >= 0, e.truth_agnostic_match + offset, -1)
+            for e, offset in zip(evaluations, offsets)
+        ]], axis=1)
+
+        size = n_cat + 1
+        confusion = np.zeros((n_thresh, size, size), np.int64)
+        for i in range(n_thresh):
+            matched = match[i] >= 0
+            pred_matched = np.zeros(len(pred_index), bool)
+            pred_matched[match[i][matched]] = True
+            rows = np.concatenate([
+                truth_index[matched],
+                truth_index[~matched],
+                np.full(np.count_nonzero(~pred_matched), n_cat),
+            ])
+            cols = np.concatenate([
+                pred_index[match[i][matched]],
+                np.full(np.count_nonzero(~matched), n_cat),
+                pred_index[~pred_matched],
+            ])
+            confusion[i] = np.bincount(rows*size + cols, minlength=size*size).reshape(size, size)
+        return confusion
+
+    def selected(
+            self,
+            category_id: Optional[int] = None,
+            area_range: Optional[Tuple[float, float]] = None,
+    ) -> Tuple[np.ndarray, int, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Restrict results to truths of category $category_id and/or with area
+        in [min, max) $area_range.
+
+        A prediction is kept if it was matched to a selected truth, or if it
+        was not matched at all and itself satisfies the selection; predictions
+        matched only to unselected truths are ignored.
+
+        Returns (num_matches, gtp, included, scores, pred_is_tp, pred_iou),
+        where (T, P) array $included flags kept predictions at each threshold.
+        """
+        n_thresh = len(self.iou_thresh)
+        num_matches = np.zeros(n_thresh, np.int64)
+        gtp = 0
+        included = [np.zeros((n_thresh, 0), bool)]
+        for e in self.evaluations.values():
+            truth_sel = np.ones(e.num_truth, bool)
+            pred_sel = np.ones(e.num_preds, bool)
+            if category_id is not None:
+                truth_sel &= e.truth_category == category_id
+                pred_sel &= e.pred_category == category_id
+            if area_range is not None:
+                lo, hi = area_range
+                truth_sel &= (e.truth_area >= lo) & (e.truth_area < hi)
+                pred_sel &= (e.pred_area >= lo) & (e.pred_area < hi)
+
+            gtp += int(np.count_nonzero(truth_sel))
+            matched_sel = np.zeros((n_thresh, e.num_preds), bool)
+            for i in range(n_thresh):
+                matches = e.truth_match[i][truth_sel]
+                matches = matches[matches >= 0]
+                num_matches[i] += len(matches)
+                matched_sel[i, matches] = True
+            included.append(matched_sel | (~e.pred_is_tp & pred_sel))
+
+        included = np.concatenate(included, axis=1)
+        scores, pred_is_tp, pred_iou = self.concatenated()
+        return num_matches, gtp, included, scores, pred_is_tp & included, pred_iou
+
+    @profiling.timed('Accumulator.metrics')
+    def metrics(
+            self,
+            category_id: Optional[int] = None,
+            area_range: Optional[Tuple[float, float]] = None,
+    ) -> Dict[str, float]:
+        """
+        Metrics over all images, optionally restricted to a category and/or
+        area range (see selected()).
+        """
+        should_calc_AP = self.should_calc_AP()
+        if category_id is None and area_range is None:
+            num_matches, gtp = self.num_matches, self.num_truth
+            num_preds = np.full(len(self.iou_thresh), self.num_preds)
+            included = None
+            if should_calc_AP:
+                _, ranked_is_tp = self.ranked()
+        else:
+            num_matches, gtp, included, scores, pred_is_tp, pred_iou = self.selected(category_id, area_range)
+            num_preds = np.count_nonzero(included, axis=1)
+
+        metrics = {}
+        for i, thresh in enumerate(self.iou_thresh):
+            tp = int(num_matches[i])
+            fp = int(num_preds[i]) - tp
+            p = tp / (tp + fp) if num_preds[i] else 0.0
+            r = tp / gtp if gtp else 0.0
+            f1 = 2*p*r/(p + r) if tp else 0.0
+
+            tname = str(int(thresh*100))
+            metrics[f'P_{tname}'] = p
+            metrics[f'R_{tname}'] = r
+            metrics[f'F1_{tname}'] = f1
+
+            if should_calc_AP and included is None:
+                metrics[f'AP_{tname}'] = calculate_AP_from_ranked(ranked_is_tp[i], gtp)
+            elif should_calc_AP:
+                rank = pred_iou[i] if self.sort_by_iou else scores
+                rank, is_tp = rank[included[i]], pred_is_tp[i][included[i]]
+                metrics[f'AP_{tname}'] = calculate_AP_from_arrays(rank, is_tp, gtp)
+
+        if len(self.iou_thresh) > 1:
+            metrics['mAP'] = np.mean([v for k, v in metrics.items() if 'AP' in k])
+            metrics['mF1'] = np.mean([v for k, v in metrics.items() if 'F1' in k])
+        return metrics
+
+    @profiling.timed('Accumulator.pr_curves')
+    def pr_curves(
+            self,
+            recall: np.ndarray,
+            category_id: Optional[int] = None,
+            area_range: Optional[Tuple[float, float]] = None,
+    ) -> np.ndarray:
+        """
+        (T, R) interpolated precision at each of (ascending) $recall levels,
+        for each threshold. Optionally restricted as in metrics().
+        """
+        if category_id is None and area_range is None:
+            gtp, included = self.num_truth, None
+            scores, pred_is_tp, pred_iou = self.concatenated()
+        else:
+            _, gtp, included, scores, pred_is_tp, pred_iou = self.selected(category_id, area_range)
+
+        curves = np.zeros((len(self.iou_thresh), len(recall)), np.float64)
+        for i in range(len(self.iou_thresh)):
+            rank = pred_iou[i] if self.sort_by_iou else scores
+            is_tp = pred_is_tp[i]
+            if included is not None:
+                rank, is_tp = rank[included[i]], is_tp[included[i]]
+            curves[i] = precision_at_recall(rank, is_tp, gtp, recall)
+        return curves
@@ -1,27 +1,80 @@
-from typing import List
+from typing import List, Tuple
 
 import numpy as np
 
 from ..dataset import Annotation
+from .. import profiling
 
 
+@profiling.timed('calculate_AP')
 def calculate_AP(predicted_matched_annotations: List[Annotation], sort_by_iou: bool, gtp: int) -> float:
-    ps, rs = [], []
-    tp, fp = 0, 0
-    for pred in sorted(predicted_matched_annotations, key=lambda p: -p.relevant_iou if sort_by_iou else -p.score):
-        if pred.is_tp:
-            tp += 1
-        else:
-            fp += 1
-        
-        ps.append(tp / (tp + fp))
-        rs.append(tp / gtp)
-    
+    rank = [p.relevant_iou if sort_by_iou else p.score for p in predicted_matched_annotations]
+    is_tp = [p.is_tp for p in predicted_matched_annotations]
+    return calculate_AP_from_arrays(np.array(rank, np.float64), np.array(is_tp, bool), gtp)
+
+
+def precision_recall_from_ranked(is_tp: np.ndarray, gtp: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Interpolated precision and recall after each prediction, with $is_tp
+    marking true positives among predictions already in rank order.
+    """
+    tp = np.cumsum(is_tp)
+    ps = tp / np.arange(1, len(is_tp) + 1)
+    rs = tp / gtp
+
     # interpolate precision to be monotonically decreasing
-    pinterp = []
-    for i in range(len(rs)):
-        pinterp.append(max(ps[-i-1:]))
-    pinterp = pinterp[::-1]
+    pinterp = np.maximum.accumulate(ps[::-1])[::-1]
+    return pinterp, rs
+
+
+def precision_recall_from_arrays(rank: np.ndarray, is_tp: np.ndarray, gtp: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Interpolated precision and recall after each prediction, with predictions
+    ranked (descending) by $rank and $is_tp marking true positives.
+    """
+    return precision_recall_from_ranked(is_tp[np.argsort(-rank, kind='stable')], gtp)
+
+
+def calculate_AP_from_ranked(is_tp: np.ndarray, gtp: int) -> float:
+    """
+    Calculate AP of predictions already in rank order, where $is_tp marks
+    whether each prediction is a true positive.
+    """
+    if not len(is_tp) or not gtp:
+        return 0.0
+
+    pinterp, rs = precision_recall_from_ranked(is_tp, gtp)
 
     # return area under (interpolated) precision-recall curve
-    return float(np.trapz(pinterp, rs))
\ No newline at end of file
+    return float(np.trapz(pinterp, rs))
+
+
+@profiling.timed('calculate_AP_from_arrays')
+def calculate_AP_from_arrays(rank: np.ndarray, is_tp: np.ndarray, gtp: int) -> float:
+    """
+    Calculate AP of predictions ranked (descending) by $rank, where $is_tp
+    marks whether each prediction is a true positive.
+    """
+    return calculate_AP_from_ranked(is_tp[np.argsort(-rank, kind='stable')], gtp)
+
+
+# recall levels within this of a recall reached count as reached, so that
+# levels such as 0.1*3 = 0.30000000000000004 are not missed
+RECALL_TOLERANCE = 1e-9
+
+
+def precision_at_recall(rank: np.ndarray, is_tp: np.ndarray, gtp: int, recall: np.ndarray) -> np.ndarray:
+    """
+    Interpolated precision (as in calculate_AP_from_arrays) at each of
+    (ascending) $recall levels; 0 where the level is never reached.
+    """
+    precision = np.zeros(len(recall), np.float64)
+    if not len(rank) or not gtp:
+        return precision
+
+    pinterp, rs = precision_recall_from_arrays(rank, is_tp, gtp)
+    # first prediction at which each recall level is reached
+    index = np.searchsorted(rs, np.asarray(recall) - RECALL_TOLERANCE, side='left')
+    reached = index < len(rs)
+    precision[reached] = pinterp[index[reached]]
+    return precision
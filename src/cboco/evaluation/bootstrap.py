@@ -0,0 +1,176 @@
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .accumulate import Accumulator
+from .. import profiling
+
+
+def _weighted_AP(data: Dict[str, np.ndarray], i: int, weights: np.ndarray, gtp: np.ndarray) -> np.ndarray:
+    """
+    AP at threshold index $i for each row of (B, I) array $weights, equal to
+    calculate_AP_from_arrays() on the resampled predictions, in which a
+    prediction drawn k times is k consecutive, equally ranked predictions.
+
+    The area under the curve is summed over true positives, each of which
+    steps recall up by 1/gtp per copy. Copies after the first add a step at
+    their own (interpolated) precision, as do those of the first prediction
+    drawn; otherwise the first copy's step is a trapezium from the previous
+    drawn prediction. Predictions not drawn add nothing.
+    """
+    order = data['order'][i]
+    pred_weights = weights[:, data['pred_image'][order]]
+    tp_weights = pred_weights*data['pred_is_tp'][i, order]
+    tp_cum = np.cumsum(tp_weights, axis=1)
+    n_cum = np.cumsum(pred_weights, axis=1)
+    ps = np.where(n_cum > 0, tp_cum / np.maximum(n_cum, 1.0), 0.0)
+    pinterp = np.maximum.accumulate(ps[:, ::-1], axis=1)[:, ::-1]
+
+    previous = np.concatenate([np.zeros((len(weights), 1)), pinterp[:, :-1]], axis=1)
+    first_step = np.where(n_cum - pred_weights > 0, (previous + pinterp)/2, 0.0)
+    area = np.where(tp_weights > 0, first_step + (tp_weights - 1)*pinterp, 0.0).sum(axis=1)
+    return np.where(gtp > 0, area / np.maximum(gtp, 1.0), 0.0)
+
+
+def _weighted_metrics(
+        data: Dict[str, np.ndarray],
+        iou_thresh: List[float],
+        calc_AP: bool,
+        weights: np.ndarray,
+) -> Dict[str, np.ndarray]:
+    """
+    Calculate metrics for each row of (B, I) array $weights, the number of
+    times each image in $data is drawn in a resample.
+    """
+    num_matches = weights @ data['num_matches']
+    num_preds = weights @ data['num_preds']
+    gtp = weights @ data['num_truth']
+
+    metrics = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i, thresh in enumerate(iou_thresh):
+            tp = num_matches[:, i]
+            p = np.where(num_preds > 0, tp / num_preds, 0.0)
+            r = np.where(gtp > 0, tp / gtp, 0.0)
+            f1 = np.where(tp > 0, 2*p*r/(p + r), 0.0)
+
+            tname = str(int(thresh*100))
+            metrics[f'P_{tname}'] = p
+            metrics[f'R_{tname}'] = r
+            metrics[f'F1_{tname}'] = f1
+
+            if calc_AP:
+                metrics[f'AP_{tname}'] = _weighted_AP(data, i, weights, gtp)
+
+    if len(iou_thresh) > 1:
+        aps = [v for k, v in metrics.items() if 'AP' in k]
+        # nan without AP, as Accumulator.metrics() reports, but one per resample
+        metrics['mAP'] = np.mean(aps, axis=0) if aps else np.full(len(weights), np.nan)
+        metrics['mF1'] = np.mean([v for k, v in metrics.items() if 'F1' in k], axis=0)
+    return metrics
+
+
+def _resampled_metrics(
+        data: Dict[str, np.ndarray],
+        iou_thresh: List[float],
+        calc_AP: bool,
+        n: int,
+        seed: np.random.SeedSequence,
+) -> Dict[str, np.ndarray]:
+    """
+    Calculate metrics for $n resamples (with replacement) of the images in
+    $data. All $n resamples are evaluated at once.
+    """
+    rng = np.random.default_rng(seed)
+    n_images = len(data['num_truth'])
+    weights = rng.multinomial(n_images, np.full(n_images, 1.0/n_images), size=n).astype(np.float64)
+    return _weighted_metrics(data, iou_thresh, calc_AP, weights)
+
+
+# set in each worker process by _init_worker, so data is only sent once
+_worker_args = None
+
+
+def _init_worker(*args):
+    global _worker_args
+    _worker_args = args
+
+
+def _worker_resampled_metrics(n: int, seed: np.random.SeedSequence) -> Dict[str, np.ndarray]:
+    return _resampled_metrics(*_worker_args, n, seed)
+
+
+def _resampling_data(accumulator: Accumulator) -> Dict[str, np.ndarray]:
+    """Per-image counts and per-prediction TP flags in rank order, for resampling."""
+    evaluations = list(accumulator.evaluations.values())
+    assert evaluations, 'Nothing to resample!'
+
+    scores, pred_is_tp, pred_iou = accumulator.concatenated()
+    rank = pred_iou if accumulator.sort_by_iou else np.broadcast_to(scores, pred_iou.shape)
+    return dict(
+        num_matches=np.array([e.num_matches for e in evaluations], np.float64),
+        num_preds=np.array([e.num_preds for e in evaluations], np.float64),
+        num_truth=np.array([e.num_truth for e in evaluations], np.float64),
+        pred_image=np.repeat(np.arange(len(evaluations)), [e.num_preds for e in evaluations]),
+        pred_is_tp=pred_is_tp,
+        order=np.argsort(-rank, axis=1, kind='stable'),
+    )
+
+
+# elements in each (chunk, predictions) array made per resample chunk
+CHUNK_ELEMENTS = 1 << 22
+
+
+@profiling.timed('bootstrap_metrics')
+def bootstrap_metrics(
+        accumulator: Accumulator,
+        n_resamples=1000,
+        processes: Optional[int] = None,
+        chunk_size: Optional[int] = None,
+        seed: Optional[int] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Calculate each metric on $n_resamples bootstrap resamples of the images
+    in $accumulator. Resamples are split into chunks of $chunk_size (by
+    default, as many as keep arrays of all predictions to CHUNK_ELEMENTS) and
+    spread over $processes worker processes (set to 1 to run in-process).
+
+    Returns dict of metric name to (n_resamples,) array of values.
+    """
+    if n_resamples < 1:
+        raise ValueError(f'Need at least one resample, got {n_resamples}.')
+    args = (_resampling_data(accumulator), accumulator.iou_thresh, accumulator.should_calc_AP())
+    if chunk_size is None:
+        chunk_size = max(1, min(100, CHUNK_ELEMENTS // max(len(args[0]['pred_image']), 1)))
+
+    sizes = [min(chunk_size, n_resamples - i) for i in range(0, n_resamples, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if processes == 1:
+        chunks = [_resampled_metrics(*args, n, s) for n, s in zip(sizes, seeds)]
+    else:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=args) as pool:
+            chunks = list(pool.map(_worker_resampled_metrics, sizes, seeds))
+
+    return {k: np.concatenate([c[k] for c in chunks]) for k in chunks[0]}
+
+
+def bootstrap_intervals(
+        accumulator: Accumulator,
+        confidence=0.95,
+        n_resamples=1000,
+        processes: Optional[int] = None,
+        seed: Optional[int] = None,
+) -> Dict[str, Tuple[float, float]]:
+    """
+    Bootstrap (percentile) confidence intervals at level $confidence for
+    each metric reported by $accumulator.
+
+    Returns dict of metric name to (low, high).
+    """
+    resampled = bootstrap_metrics(accumulator, n_resamples, processes, seed=seed)
+    alpha = (1.0 - confidence)*50.0
+    return {
+        k: (float(np.percentile(v, alpha)), float(np.percentile(v, 100.0 - alpha)))
+        for k, v in resampled.items()
+    }
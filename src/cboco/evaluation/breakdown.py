@@ -0,0 +1,71 @@
+from typing import Dict, List, Tuple
+from dataclasses import dataclass
+
+import numpy as np
+
+from ..dataset import Dataset, Annotation, Category
+
+from .accumulate import Accumulator
+from .evaluate_dataset import accumulate_dataset
+
+
+# COCO-style area ranges, [min, max) in square pixels
+AREA_RANGES = {
+    'small': (0, 32**2),
+    'medium': (32**2, 96**2),
+    'large': (96**2, np.inf),
+}
+
+
+@dataclass
+class Breakdown:
+    """Evaluation metrics overall, and broken down by category and by area range."""
+    overall: Dict[str, float]
+    by_category: Dict[str, Dict[str, float]]
+    by_area: Dict[str, Dict[str, float]]
+
+
+def breakdown_metrics(
+        accumulator: Accumulator,
+        categories: List[Category],
+        area_ranges: Dict[str, Tuple[float, float]] = AREA_RANGES,
+) -> Breakdown:
+    """Break down accumulated results by each of $categories and $area_ranges."""
+    return Breakdown(
+        overall=accumulator.metrics(),
+        by_category={
+            cat.name: accumulator.metrics(category_id=cat.id)
+            for cat in categories
+        },
+        by_area={
+            name: accumulator.metrics(area_range=area_range)
+            for name, area_range in area_ranges.items()
+        },
+    )
+
+
+def evaluate_dataset_breakdown(
+        preds: Dataset,
+        truth: Dataset,
+        iou_method=Annotation.IoUMethod.Box,
+        iou_thresh=0.5,
+        class_agnostic=False,
+        matching='coco',
+        sort_by_iou=False,
+        show_progress=True,
+        area_ranges: Dict[str, Tuple[float, float]] = AREA_RANGES,
+) -> Breakdown:
+    """
+    As evaluate_dataset, but also report metrics per category (of $truth)
+    and per area range, all from the one matching pass.
+    """
+    accumulator = accumulate_dataset(
+        preds, truth,
+        iou_method=iou_method,
+        iou_thresh=iou_thresh,
+        class_agnostic=class_agnostic,
+        matching=matching,
+        sort_by_iou=sort_by_iou,
+        show_progress=show_progress,
+    )
+    return breakdown_metrics(accumulator, truth.categories, area_ranges)
@@ -0,0 +1,209 @@
+from typing import Callable, Dict, Optional
+from dataclasses import fields
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+
+from ..dataset import Dataset, Annotation
+from .. import profiling
+from ..hashing import file_digest
+
+from .evaluate_image import ImageOverlaps
+from .evaluate_dataset import dataset_overlaps, accumulate_overlaps, _as_list
+from .accumulate import Accumulator
+
+
+DEFAULT_CACHE_DIR = os.path.join('~', '.cache', 'cboco')
+DEFAULT_MAX_SIZE = 1 << 30
+
+# part of every key: change when the format or meaning of entries changes, so
+# that entries written by older versions are never reused
+CACHE_VERSION = 2
+
+
+def save_overlaps(fn: str, overlaps: Dict[str, ImageOverlaps]):
+    """
+    Write per-image IoUs to compressed numpy archive $fn. IoU matrices are
+    flattened and joined; other arrays are joined along their only axis.
+    """
+    images = list(overlaps.values())
+    arrays = {}
+    for field in fields(ImageOverlaps):
+        per_image = [getattr(o, field.name).ravel() for o in images]
+        arrays[field.name] = np.concatenate(per_image) if per_image else np.zeros(0)
+    np.savez_compressed(
+        fn,
+        keys=np.array(list(overlaps), dtype=str),
+        num_preds=np.array([o.num_preds for o in images], np.int64),
+        num_truth=np.array([o.num_truth for o in images], np.int64),
+        **arrays,
+    )
+
+
+def load_overlaps(fn: str) -> Dict[str, ImageOverlaps]:
+    """Read per-image IoUs written by save_overlaps()."""
+    with np.load(fn) as data:
+        num_preds, num_truth = data['num_preds'], data['num_truth']
+        per_image = {}
+        for field in fields(ImageOverlaps):
+            if field.name == 'ious':
+                sizes = num_preds*num_truth
+            elif field.name.startswith('truth'):
+                sizes = num_truth
+            else:
+                sizes = num_preds
+            per_image[field.name] = np.split(data[field.name], np.cumsum(sizes)[:-1])
+        overlaps = {}
+        for i, key in enumerate(data['keys']):
+            image = {k: v[i] for k, v in per_image.items()}
+            image['ious'] = image['ious'].reshape(num_truth[i], num_preds[i])
+            overlaps[str(key)] = ImageOverlaps(**image)
+    return overlaps
+
+
+class ResultCache:
+    """
+    On-disk cache of evaluation results, keyed by the content of the truth
+    and prediction files and the evaluation settings.
+
+    Two kinds of entry are kept: the matched per-image results for an exact
+    set of settings, and the per-image IoUs, which depend only on the files
+    and IoU method. The latter let queries with new thresholds, matching
+    method etc. skip loading datasets and calculating IoUs.
+
+    When the cache grows beyond $max_size bytes, the least recently used
+    entries are removed.
+    """
+
+    def __init__(self, directory: Optional[str] = None, max_size=DEFAULT_MAX_SIZE):
+        if directory is None:
+            directory = os.environ.get('CBOCO_CACHE_DIR', DEFAULT_CACHE_DIR)
+        self.directory = os.path.expanduser(directory)
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(**parts) -> str:
+        parts = dict(parts, cache_version=CACHE_VERSION)
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+    def path(self, kind: str, key: str) -> str:
+        return os.path.join(self.directory, f'{kind}-{key}.npz')
+
+    def _get(self, kind: str, key: str, load: Callable):
+        fn = self.path(kind, key)
+        try:
+            value = load(fn)
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            # missing, or corrupt
+            profiling.count(f'cache misses ({kind})')
+            return None
+        # mark as recently used
+        os.utime(fn)
+        profiling.count(f'cache hits ({kind})')
+        return value
+
+    def _put(self, kind: str, key: str, save: Callable, value):
+        fn = self.path(kind, key)
+        # write then rename, so concurrent readers never see a partial entry;
+        # the temporary file is unique to this writer, and not an entry, so
+        # never evicted
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                save(f, value)
+            os.replace(tmp, fn)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        self.evict()
+
+    def get_accumulator(self, key: str) -> Optional[Accumulator]:
+        return self._get('acc', key, Accumulator.load)
+
+    def put_accumulator(self, key: str, accumulator: Accumulator):
+        self._put('acc', key, lambda fn, acc: acc.save(fn), accumulator)
+
+    def get_overlaps(self, key: str) -> Optional[Dict[str, ImageOverlaps]]:
+        return self._get('iou', key, load_overlaps)
+
+    def put_overlaps(self, key: str, overlaps: Dict[str, ImageOverlaps]):
+        self._put('iou', key, save_overlaps, overlaps)
+
+    def size(self) -> int:
+        return sum(e.stat().st_size for e in os.scandir(self.directory) if e.is_file())
+
+    def evict(self):
+        """Remove least recently used entries until within size limit."""
+        entries = []
+        for e in os.scandir(self.directory):
+            if e.is_file() and e.name.endswith('.npz'):
+                try:
+                    st = e.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, e.path))
+        total = 0
+        for _, size, fn in sorted(entries, reverse=True):
+            total += size
+            if total > self.max_size:
+                try:
+                    os.remove(fn)
+                except FileNotFoundError:
+                    pass
+
+    def clear(self):
+        for e in os.scandir(self.directory):
+            if e.is_file() and e.name.endswith('.npz'):
+                os.remove(e.path)
+
+
+@profiling.timed('cached_accumulate')
+def cached_accumulate(
+        preds_fn: str,
+        truth_fn: str,
+        cache: ResultCache,
+        iou_method=Annotation.IoUMethod.Box,
+        iou_thresh=0.5,
+        class_agnostic=False,
+        matching='coco',
+        sort_by_iou=False,
+        show_progress=True,
+        load: Callable[[str], Dataset] = Dataset.from_json,
+        confusion=False,
+        memory_budget: Optional[int] = None,
+) -> Accumulator:
+    """
+    As accumulate_dataset(), for datasets in json files $preds_fn and
+    $truth_fn, reusing results from $cache where possible.
+
+    Datasets are only loaded (with $load) if their IoUs are not cached.
+    """
+    iou_thresh = _as_list(iou_thresh)
+    files = dict(preds=file_digest(preds_fn), truth=file_digest(truth_fn), iou_method=iou_method.name)
+    overlaps_key = cache.key(**files)
+    accumulator_key = cache.key(
+        **files,
+        iou_thresh=iou_thresh,
+        class_agnostic=class_agnostic,
+        matching=matching,
+        sort_by_iou=sort_by_iou,
+        confusion=confusion,
+    )
+
+    accumulator = cache.get_accumulator(accumulator_key)
+    if accumulator is not None:
+        return accumulator
+
+    overlaps = cache.get_overlaps(overlaps_key)
+    if overlaps is None:
+        overlaps = dataset_overlaps(load(preds_fn), load(truth_fn), iou_method, show_progress, memory_budget)
+        cache.put_overlaps(overlaps_key, overlaps)
+
+    accumulator = accumulate_overlaps(overlaps, iou_thresh, class_agnostic, matching, sort_by_iou, confusion)
+    cache.put_accumulator(accumulator_key, accumulator)
+    return accumulator
@@ -0,0 +1,52 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from ..dataset import Category
+
+from .accumulate import Accumulator
+
+
+# as COCO: recall 0 to 1 in steps of 0.01
+RECALL_POINTS = 101
+
+
+def pr_curves(
+        accumulator: Accumulator,
+        categories: Optional[List[Category]] = None,
+        recall_points=RECALL_POINTS,
+) -> Dict[str, np.ndarray]:
+    """
+    Precision-recall curves at each threshold of $accumulator, sampled at
+    $recall_points evenly spaced recall levels from 0 to 1.
+
+    Returns dict of:
+     - 'recall': (R,) recall levels,
+     - 'iou_thresh': (T,) thresholds,
+     - 'precision': (T, R) interpolated precision over all categories,
+    and, if $categories are given:
+     - 'category_ids', 'category_names': (C,) categories,
+     - 'precision_by_category': (C, T, R) precision of each category.
+    """
+    recall = np.linspace(0.0, 1.0, recall_points)
+    curves = dict(
+        recall=recall,
+        iou_thresh=np.array(accumulator.iou_thresh, np.float64),
+        precision=accumulator.pr_curves(recall),
+    )
+    if categories:
+        curves['category_ids'] = np.array([cat.id for cat in categories], np.int64)
+        curves['category_names'] = np.array([cat.name for cat in categories], dtype=str)
+        curves['precision_by_category'] = np.stack([
+            accumulator.pr_curves(recall, category_id=cat.id)
+            for cat in categories
+        ])
+    return curves
+
+
+def save_curves(fn: str, curves: Dict[str, np.ndarray]):
+    """Write $curves to compressed numpy archive $fn, with values as float32."""
+    np.savez_compressed(fn, **{
+        k: v.astype(np.float32) if v.dtype == np.float64 else v
+        for k, v in curves.items()
+    })
@@ -1,68 +1,176 @@
-from typing import Dict, List
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
-import numpy as np
+from ..dataset import Dataset, Annotation, Image
+from .. import profiling
 
-from ..dataset import Dataset, Annotation
+from .evaluate_image import evaluate_image, image_overlaps, match_overlaps, ImageOverlaps
+from .accumulate import Accumulator
+from .intersection import align_images
 
-from .match import match_all_preds_to_truth
-from .precalculate import precalculate_combinatorial_ious
-from .ap import calculate_AP
-from .intersection import get_datasets_intersection
 
+def _as_list(iou_thresh) -> List[float]:
+    # ensure IoU thresh is iterable
+    try:
+        _ = len(iou_thresh)
+    except TypeError:
+        iou_thresh = [iou_thresh]
+    return list(iou_thresh)
 
-def evaluate_dataset(
+
+def _mask_size(image: Image) -> int:
+    """Bytes needed to hold the masks of all annotations of $image."""
+    return image.width*image.height*len(image.annotations)
+
+
+def _in_chunks(
+        pairs: Iterable[Tuple[Image, Image]],
+        iou_method=Annotation.IoUMethod.Box,
+        memory_budget: Optional[int] = None,
+) -> Iterator[Tuple[Image, Image]]:
+    """
+    Yield aligned image $pairs. With mask IoU and a $memory_budget (bytes),
+    they come in chunks whose masks fit in the budget: each chunk's masks are
+    drawn up front (in parallel) and released once the chunk is done with.
+    """
+    if memory_budget is None or iou_method != Annotation.IoUMethod.Mask:
+        yield from pairs
+        return
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    def draw(annotation: Annotation):
+        return annotation.mask is not None
+
+    def chunks():
+        chunk, size = [], 0
+        for pair in pairs:
+            pair_size = sum(_mask_size(image) for image in pair)
+            if chunk and size + pair_size > memory_budget:
+                yield chunk
+                chunk, size = [], 0
+            chunk.append(pair)
+            size += pair_size
+        if chunk:
+            yield chunk
+
+    with ThreadPoolExecutor() as pool:
+        for chunk in chunks():
+            annotations = [ann for pair in chunk for image in pair for ann in image.annotations]
+            with profiling.timer('draw masks'):
+                list(pool.map(draw, annotations))
+            profiling.count('chunks evaluated')
+            try:
+                yield from chunk
+            finally:
+                for ann in annotations:
+                    ann.release_mask()
+
+
+@profiling.timed('dataset_overlaps')
+def dataset_overlaps(
+        preds: Dataset,
+        truth: Dataset,
+        iou_method=Annotation.IoUMethod.Box,
+        show_progress=True,
+        memory_budget: Optional[int] = None,
+) -> Dict[str, ImageOverlaps]:
+    """
+    Calculate truth/prediction IoUs for each image common to both datasets,
+    keyed by image hashable name. See accumulate_dataset() for $memory_budget.
+    """
+    assert len(preds.categories) == len(truth.categories), f'{preds.categories} != {truth.categories}'
+
+    pairs = align_images(preds, truth)
+    if show_progress:
+        from tqdm import tqdm
+        pairs = tqdm(pairs, unit='images')
+
+    return {
+        true_image.hashable_name: image_overlaps(true_image.annotations, pred_image.annotations, iou_method)
+        for pred_image, true_image in _in_chunks(pairs, iou_method, memory_budget)
+    }
+
+
+@profiling.timed('accumulate_overlaps')
+def accumulate_overlaps(
+        overlaps: Dict[str, ImageOverlaps],
+        iou_thresh=0.5,
+        class_agnostic=False,
+        matching='coco',
+        sort_by_iou=False,
+        confusion=False,
+) -> Accumulator:
+    """Match predictions to truth for each image of pre-calculated $overlaps."""
+    iou_thresh = _as_list(iou_thresh)
+    accumulator = Accumulator(iou_thresh, sort_by_iou)
+    for key, image in overlaps.items():
+        accumulator.add(key, match_overlaps(image, iou_thresh, class_agnostic, matching, confusion))
+    return accumulator
+
+
+@profiling.timed('accumulate_dataset')
+def accumulate_dataset(
         preds: Dataset,
         truth: Dataset,
         iou_method=Annotation.IoUMethod.Box,
         iou_thresh=0.5,
         class_agnostic=False,
+        matching='coco',
         sort_by_iou=False,
         show_progress=True,
-) -> Dict[str, float]:
+        confusion=False,
+        memory_budget: Optional[int] = None,
+) -> Accumulator:
+    """
+    Match predictions to truth for each image common to both datasets. With
+    $confusion, also keep what's needed for Accumulator.confusion_matrix().
+
+    Masks are kept once drawn. For mask IoU on datasets whose masks do not
+    fit in memory, set $memory_budget (bytes) to work through images in
+    chunks, drawing masks for a chunk at a time and releasing them after.
+    """
     assert len(preds.categories) == len(truth.categories), f'{preds.categories} != {truth.categories}'
 
-    preds, truth = get_datasets_intersection(preds, truth)
-    pann, tann = preds.annotations, truth.annotations
+    pairs = align_images(preds, truth)
+    iou_thresh = _as_list(iou_thresh)
 
-    ious = precalculate_combinatorial_ious(truth.annotations, preds.annotations, iou_method, show_progress)
+    if show_progress:
+        from tqdm import tqdm
+        pairs = tqdm(pairs, unit='images')
 
-    should_calc_AP = sort_by_iou or pann[0].score
-    
-    # ensure IoU thresh is iterable
-    try:
-        _ = len(iou_thresh)
-    except TypeError:
-        iou_thresh = [iou_thresh]
-    
-    gtp = len(tann)
-    
-    metrics = {}
-    for thresh in iou_thresh:
-        # reset annotations
-        for _pann in pann:
-            _pann.is_tp = False
-            _pann.relevant_iou = 0.0
-        
-        matches = match_all_preds_to_truth(tann, pann, ious, thresh, class_agnostic)
-        for _tann, _pann in matches:
-            _pann.is_tp = True
-            _pann.relevant_iou = ious[_tann.id, _pann.id]
-        
-        tp = len(matches)
-        fp = len(pann) - tp
-        p = tp / (tp + fp)
-        r = tp / gtp
-        f1 = 2*p*r/(p + r) if tp else 0.0
-
-        tname = str(int(thresh*100))
-        metrics[f'P_{tname}'] = p
-        metrics[f'R_{tname}'] = r
-        metrics[f'F1_{tname}'] = f1
-
-        if should_calc_AP:
-            metrics[f'AP_{tname}'] = calculate_AP(pann, sort_by_iou, gtp)
-    
-    if len(iou_thresh) > 1:
-        metrics['mAP'] = np.mean([v for k, v in metrics.items() if 'AP' in k])
-        metrics['mF1'] = np.mean([v for k, v in metrics.items() if 'F1' in k])
-    return metrics
\ No newline at end of file
+    accumulator = Accumulator(iou_thresh, sort_by_iou)
+    for pred_image, true_image in _in_chunks(pairs, iou_method, memory_budget):
+        accumulator.add(true_image.hashable_name, evaluate_image(
+            true_image.annotations, pred_image.annotations,
+            iou_thresh, iou_method, class_agnostic, matching, confusion,
+        ))
+    return accumulator
+
+
+def evaluate_dataset(
+        preds: Dataset,
+        truth: Dataset,
+        iou_method=Annotation.IoUMethod.Box,
+        iou_thresh=0.5,
+        class_agnostic=False,
+        matching='coco',
+        sort_by_iou=False,
+        show_progress=True,
+        memory_budget: Optional[int] = None,
+) -> Dict[str, float]:
+    """
+    Metrics of $preds evaluated against $truth. For confusion matrices or
+    precision-recall curves, use accumulate_dataset() (with confusion=True
+    for the former) and then Accumulator.confusion_matrix() or
+    curves.pr_curves().
+    """
+    return accumulate_dataset(
+        preds, truth,
+        iou_method=iou_method,
+        iou_thresh=iou_thresh,
+        class_agnostic=class_agnostic,
+        matching=matching,
+        sort_by_iou=sort_by_iou,
+        show_progress=show_progress,
+        memory_budget=memory_budget,
+    ).metrics()
@@ -0,0 +1,167 @@
+from typing import List, Optional
+from dataclasses import dataclass
+
+import numpy as np
+
+from ..dataset import Annotation, iou_matrix, areas_of
+
+from .match import match_image
+from .. import profiling
+
+
+@dataclass
+class ImageEvaluation:
+    """
+    Result of matching the predictions on a single image to its truths, at
+    each of a number of IoU thresholds.
+    """
+    # (P,) prediction scores, nan where prediction has no score
+    scores: np.ndarray
+    # (T, P) whether each prediction was matched to a truth
+    pred_is_tp: np.ndarray
+    # (T, P) IoU of the truth each prediction was matched to
+    pred_iou: np.ndarray
+    # (T, G) index of prediction matched to each truth, -1 if unmatched
+    truth_match: np.ndarray
+    # (P,) and (G,) category ids of predictions and truths
+    pred_category: np.ndarray
+    truth_category: np.ndarray
+    # (P,) and (G,) areas of predictions and truths (box or mask, as per IoU method)
+    pred_area: np.ndarray
+    truth_area: np.ndarray
+    # (T, G) index of prediction matched to each truth regardless of
+    # category, -1 if unmatched; only kept when a confusion matrix is wanted
+    truth_agnostic_match: Optional[np.ndarray] = None
+
+    @property
+    def num_preds(self) -> int:
+        return len(self.scores)
+
+    @property
+    def num_truth(self) -> int:
+        return self.truth_match.shape[1]
+
+    @property
+    def num_matches(self) -> np.ndarray:
+        """(T,) number of truths matched at each threshold."""
+        return np.count_nonzero(self.truth_match >= 0, axis=1)
+
+
+MATCHING_METHODS = {'coco', 'legacy'}
+
+
+@dataclass
+class ImageOverlaps:
+    """
+    IoU of every truth/prediction pair on a single image, with everything
+    else needed to match them. Independent of IoU threshold and matching
+    method, so can be computed once and matched in any number of ways.
+    """
+    # (G, P) IoU of each truth with each prediction
+    ious: np.ndarray
+    # (P,) prediction scores, nan where prediction has no score
+    scores: np.ndarray
+    # (P,) and (G,) category ids of predictions and truths
+    pred_category: np.ndarray
+    truth_category: np.ndarray
+    # (P,) and (G,) areas of predictions and truths (box or mask, as per IoU method)
+    pred_area: np.ndarray
+    truth_area: np.ndarray
+
+    @property
+    def num_preds(self) -> int:
+        return len(self.scores)
+
+    @property
+    def num_truth(self) -> int:
+        return len(self.truth_category)
+
+
+@profiling.timed('image_overlaps')
+def image_overlaps(
+        true_annotations: List[Annotation],
+        predicted_annotations: List[Annotation],
+        iou_method=Annotation.IoUMethod.Box,
+) -> ImageOverlaps:
+    """Calculate IoU of each of $true_annotations with each of $predicted_annotations."""
+    return ImageOverlaps(
+        ious=iou_matrix(true_annotations, predicted_annotations, iou_method),
+        scores=np.array([
+            np.nan if ann.score is None else ann.score
+            for ann in predicted_annotations
+        ], np.float64),
+        pred_category=np.array([ann.category_id for ann in predicted_annotations], np.int64),
+        truth_category=np.array([ann.category_id for ann in true_annotations], np.int64),
+        pred_area=areas_of(predicted_annotations, iou_method),
+        truth_area=areas_of(true_annotations, iou_method),
+    )
+
+
+@profiling.timed('match_overlaps')
+def match_overlaps(
+        overlaps: ImageOverlaps,
+        iou_thresh: List[float],
+        class_agnostic=False,
+        matching='coco',
+        confusion=False,
+) -> ImageEvaluation:
+    """
+    Match predictions to truths of one image at each threshold in $iou_thresh.
+
+    $matching is 'coco' (one-to-one, in descending order of score) or
+    'legacy' (each truth takes its best pred; preds may match several truths).
+
+    With $confusion, predictions are also matched regardless of category
+    (reusing the IoUs), for Accumulator.confusion_matrix().
+    """
+    if matching not in MATCHING_METHODS:
+        raise ValueError(f'Unknown matching method "{matching}", expected one of {MATCHING_METHODS}.')
+
+    ious = overlaps.ious
+    truth_match, pred_match = match_image(
+        ious, overlaps.truth_category, overlaps.pred_category, iou_thresh, class_agnostic,
+        scores=overlaps.scores, one_to_one=matching == 'coco',
+    )
+    pred_is_tp = pred_match >= 0
+    pred_iou = np.zeros(pred_match.shape, np.float64)
+    t, p = np.nonzero(pred_is_tp)
+    pred_iou[t, p] = ious[pred_match[t, p], p]
+
+    truth_agnostic_match = None
+    if confusion:
+        if class_agnostic:
+            truth_agnostic_match = truth_match
+        else:
+            truth_agnostic_match, _ = match_image(
+                ious, overlaps.truth_category, overlaps.pred_category, iou_thresh, True,
+                scores=overlaps.scores, one_to_one=matching == 'coco',
+            )
+
+    return ImageEvaluation(
+        overlaps.scores, pred_is_tp, pred_iou, truth_match,
+        pred_category=overlaps.pred_category,
+        truth_category=overlaps.truth_category,
+        pred_area=overlaps.pred_area,
+        truth_area=overlaps.truth_area,
+        truth_agnostic_match=truth_agnostic_match,
+    )
+
+
+@profiling.timed('evaluate_image')
+def evaluate_image(
+        true_annotations: List[Annotation],
+        predicted_annotations: List[Annotation],
+        iou_thresh: List[float],
+        iou_method=Annotation.IoUMethod.Box,
+        class_agnostic=False,
+        matching='coco',
+        confusion=False,
+) -> ImageEvaluation:
+    """
+    Match predictions to truths of one image at each threshold in $iou_thresh.
+    See match_overlaps() for $matching and $confusion.
+    """
+    if matching not in MATCHING_METHODS:
+        raise ValueError(f'Unknown matching method "{matching}", expected one of {MATCHING_METHODS}.')
+    overlaps = image_overlaps(true_annotations, predicted_annotations, iou_method)
+    return match_overlaps(overlaps, iou_thresh, class_agnostic, matching, confusion)
@@ -1,33 +1,44 @@
-from typing import Tuple
+from typing import List, Tuple
 
-from ..dataset import Dataset
+from ..dataset import Dataset, Image
 
 
-def get_datasets_intersection(a: Dataset, b: Dataset) -> Tuple[Dataset, Dataset]:
+def align_images(a: Dataset, b: Dataset) -> List[Tuple[Image, Image]]:
+    """
+    Pair up images common to datasets $a and $b, sorted by base name.
+
+    Datasets are not modified.
+    """
     assert len(a.categories) == len(b.categories), f'{a.categories} != {b.categories}'
 
     a_images = set(a.images)
-    b_images = set(b.images)
+    b_images = {img: img for img in b.images}
     # ensure no images lost due to hash collision
     assert len(a_images) == len(a.images), 'Hash collision in A!'
     assert len(b_images) == len(b.images), 'Hash collision in B!'
 
-    common_images = set.intersection(a_images, b_images)
+    common_images = a_images.intersection(b_images)
     assert common_images, 'No common images between datasets!'
-    
+
     a_images = sorted([img for img in a_images if img in common_images], key=lambda i: i.base_name)
-    b_images = sorted([img for img in b_images if img in common_images], key=lambda i: i.base_name)
-    assert len(a_images) == len(b_images) == len(common_images), 'Images lost along the way!'
-
-    a_ann = []
-    for i, img in enumerate(a_images, start=1):
-        img.set_id(i)
-        a_ann.extend(img.annotations)
-    b_ann = []
-    for i, img in enumerate(b_images, start=1):
-        img.set_id(i)
-        b_ann.extend(img.annotations)
-    
+    pairs = [(img, b_images[img]) for img in a_images]
+    assert len(pairs) == len(common_images), 'Images lost along the way!'
+    return pairs
+
+
+def get_datasets_intersection(a: Dataset, b: Dataset) -> Tuple[Dataset, Dataset]:
+    pairs = align_images(a, b)
+
+    a_images, a_ann = [], []
+    b_images, b_ann = [], []
+    for i, (a_img, b_img) in enumerate(pairs, start=1):
+        a_img.set_id(i)
+        a_images.append(a_img)
+        a_ann.extend(a_img.annotations)
+        b_img.set_id(i)
+        b_images.append(b_img)
+        b_ann.extend(b_img.annotations)
+
     return (
         Dataset(a_images, a.categories, a_ann, **a.extra),
         Dataset(b_images, b.categories, b_ann, **b.extra),
@@ -1,6 +1,9 @@
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, Sequence
+
+import numpy as np
 
 from ..dataset import Annotation
+from .. import profiling
 
 
 def match_pred_to_truth(
@@ -20,6 +23,7 @@ def match_pred_to_truth(
     return None
 
 
+@profiling.timed('match_all_preds_to_truth')
 def match_all_preds_to_truth(
         true_annotations: List[Annotation],
         predicted_annotations: List[Annotation],
@@ -39,4 +43,56 @@ def match_all_preds_to_truth(
         matched = match_pred_to_truth(true, predicted_annotations, ious, iou_thresh, class_agnostic)
         if matched is not None:
             matches.append((true, matched))
-    return matches
\ No newline at end of file
+    return matches
+
+
+@profiling.timed('match_image')
+def match_image(
+        ious: np.ndarray,
+        true_categories: np.ndarray,
+        predicted_categories: np.ndarray,
+        iou_thresh: Sequence[float],
+        class_agnostic: bool,
+        scores: Optional[np.ndarray] = None,
+        one_to_one=True,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    given (truths x preds) IoU matrix of a single image
+    return (T, truths) index of the pred matched to each truth, and
+    (T, preds) index of the truth matched to each pred, at each of T
+    thresholds (-1 where unmatched)
+
+    With $one_to_one (COCO semantics), preds are taken in descending order of
+    $scores and each takes the best overlapping truth not already taken.
+    Otherwise (legacy), each truth takes its best overlapping pred, a pred
+    may be matched by several truths, and is reported as matched to the last.
+    """
+    thresh = np.asarray(iou_thresh, np.float64).reshape(-1)
+    n_true, n_pred = ious.shape
+    truth_match = np.full((len(thresh), n_true), -1, np.int64)
+    pred_match = np.full((len(thresh), n_pred), -1, np.int64)
+    if not n_true or not n_pred:
+        return truth_match, pred_match
+
+    # IoU of pairs that may be matched, -1 for pairs of different class
+    eligible = ious if class_agnostic else np.where(true_categories[:, None] == predicted_categories[None, :], ious, -1.0)
+
+    if one_to_one:
+        order = np.arange(n_pred) if scores is None else np.argsort(-scores, kind='stable')
+        # preds overlapping no truth can't be matched at any threshold
+        order = order[(eligible[:, order] > thresh.min()).any(axis=0)]
+        t_idx = np.arange(len(thresh))
+        for p in order:
+            candidates = np.where((eligible[None, :, p] > thresh[:, None]) & (truth_match < 0), eligible[None, :, p], -1.0)
+            best = np.argmax(candidates, axis=1)
+            ok = candidates[t_idx, best] > -1.0
+            truth_match[t_idx[ok], best[ok]] = p
+            pred_match[ok, p] = best[ok]
+    else:
+        valid = eligible[None] > thresh[:, None, None]
+        best = np.argmax(np.where(valid, eligible[None], -1.0), axis=2)
+        matched = valid.any(axis=2)
+        truth_match = np.where(matched, best, -1)
+        t, g = np.nonzero(matched)
+        np.maximum.at(pred_match, (t, best[t, g]), g)
+    return truth_match, pred_match
@@ -0,0 +1,169 @@
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import json
+
+import numpy as np
+
+from ..dataset import Dataset, Annotation, Image
+from .. import profiling
+
+from .evaluate_image import evaluate_image, ImageEvaluation
+from .evaluate_dataset import _as_list, _in_chunks
+from .accumulate import Accumulator
+from .breakdown import breakdown_metrics, Breakdown, AREA_RANGES
+from .intersection import align_images
+
+
+def annotations_digest(true_image: Image, predicted_annotations: List[Annotation]) -> str:
+    """
+    Hash of everything about $true_image (its size, on which masks are drawn,
+    and annotations) and its $predicted_annotations that affects its
+    evaluation (ids are ignored, so renumbered annotations hash the same).
+    """
+    content = [[true_image.width, true_image.height]] + [
+        [(ann.category_id, ann.score, ann.bbox, ann.segmentation) for ann in annotations]
+        for annotations in (true_image.annotations, predicted_annotations)
+    ]
+    return hashlib.sha1(json.dumps(content, default=float).encode()).hexdigest()
+
+
+class OnlineEvaluator:
+    """
+    Evaluate predictions image-by-image as they are produced, against a
+    truth dataset.
+
+    Each image is matched once when its predictions are added; metrics can
+    then be reported at any time from the accumulated results. Adding
+    predictions for an image a second time replaces the earlier ones.
+
+    State can be saved and loaded, and updated from a whole prediction
+    dataset with update(), which re-evaluates only the images whose
+    annotations have changed since they were last evaluated.
+    """
+
+    def __init__(
+            self,
+            truth: Dataset,
+            iou_method=Annotation.IoUMethod.Box,
+            iou_thresh=0.5,
+            class_agnostic=False,
+            matching='coco',
+            sort_by_iou=False,
+            confusion=False):
+        self.truth = truth
+        self.iou_method = iou_method
+        self.iou_thresh = _as_list(iou_thresh)
+        self.class_agnostic = class_agnostic
+        self.matching = matching
+        self.confusion = confusion
+        self.accumulator = Accumulator(self.iou_thresh, sort_by_iou)
+        # image key -> digest of annotations as last evaluated
+        self.digests: Dict[str, str] = {}
+
+        self.images_by_name = {image.hashable_name: image for image in truth.images}
+        images_by_base_name = {}
+        for image in truth.images:
+            images_by_base_name.setdefault(image.base_name, []).append(image)
+        # base name lookup only used where unambiguous
+        self.images_by_base_name = {k: v[0] for k, v in images_by_base_name.items() if len(v) == 1}
+
+    def get_truth_image(self, file_name: str) -> Image:
+        image = self.images_by_name.get(Image.get_hashable_name(file_name))
+        if image is None:
+            image = self.images_by_base_name.get(Image.get_hashable_name(file_name).split('/')[-1])
+        if image is None:
+            raise KeyError(f'Image "{file_name}" not in truth dataset.')
+        return image
+
+    def add(self, file_name: str, annotations: List[Annotation]) -> ImageEvaluation:
+        """Evaluate predicted $annotations on image $file_name and add to the tally."""
+        return self._add(self.get_truth_image(file_name), annotations)
+
+    def _add(self, image: Image, annotations: List[Annotation]) -> ImageEvaluation:
+        if self.iou_method == Annotation.IoUMethod.Mask:
+            for ann in annotations:
+                if ann.mask is None:
+                    ann.compute_bbox(image.width, image.height)
+
+        evaluation = evaluate_image(
+            image.annotations, annotations,
+            self.iou_thresh, self.iou_method, self.class_agnostic, self.matching, self.confusion,
+        )
+        self.accumulator.add(image.hashable_name, evaluation)
+        self.digests[image.hashable_name] = annotations_digest(image, annotations)
+        return evaluation
+
+    @profiling.timed('OnlineEvaluator.update')
+    def update(self, preds: Dataset, memory_budget: Optional[int] = None) -> List[str]:
+        """
+        Bring results up to date with prediction dataset $preds: images whose
+        (predicted or true) annotations changed are re-evaluated, new images
+        are added and images no longer in $preds are dropped. See
+        accumulate_dataset() for $memory_budget.
+
+        Returns keys of the images that were re-evaluated.
+        """
+        pairs = align_images(preds, self.truth)
+        keys = {true_image.hashable_name for _, true_image in pairs}
+        for key in set(self.digests) - keys:
+            self.accumulator.remove(key)
+            del self.digests[key]
+
+        pairs = [
+            (pred_image, true_image) for pred_image, true_image in pairs
+            if self.digests.get(true_image.hashable_name) != annotations_digest(true_image, pred_image.annotations)
+        ]
+        changed = []
+        for pred_image, true_image in _in_chunks(pairs, self.iou_method, memory_budget):
+            self._add(true_image, pred_image.annotations)
+            changed.append(true_image.hashable_name)
+        profiling.count('images re-evaluated', len(changed))
+
+        self.accumulator.sort()
+        return changed
+
+    def save(self, fn: str):
+        """Write state to compressed numpy archive $fn, to be resumed with load()."""
+        keys = list(self.accumulator.evaluations)
+        settings = dict(
+            iou_method=self.iou_method.name,
+            class_agnostic=self.class_agnostic,
+            matching=self.matching,
+            confusion=self.confusion,
+        )
+        self.accumulator.save(
+            fn,
+            digests=np.array([self.digests[k] for k in keys], dtype=str),
+            settings=np.array(json.dumps(settings)),
+        )
+
+    @classmethod
+    def load(cls, fn: str, truth: Dataset) -> "OnlineEvaluator":
+        """Resume evaluation against $truth from state written by save()."""
+        accumulator = Accumulator.load(fn)
+        with np.load(fn) as data:
+            settings = json.loads(str(data['settings']))
+            digests = [str(d) for d in data['digests']]
+        evaluator = cls(
+            truth,
+            iou_method=Annotation.IoUMethod[settings['iou_method']],
+            iou_thresh=accumulator.iou_thresh,
+            class_agnostic=settings['class_agnostic'],
+            matching=settings['matching'],
+            sort_by_iou=accumulator.sort_by_iou,
+            confusion=settings.get('confusion', False),
+        )
+        evaluator.accumulator = accumulator
+        evaluator.digests = dict(zip(accumulator.evaluations, digests))
+        return evaluator
+
+    def __len__(self) -> int:
+        return len(self.accumulator)
+
+    def metrics(self) -> Dict[str, float]:
+        """Metrics over all images added so far."""
+        return self.accumulator.metrics()
+
+    def breakdown(self, area_ranges: Dict[str, Tuple[float, float]] = AREA_RANGES) -> Breakdown:
+        """Metrics over all images added so far, by category and area range."""
+        return breakdown_metrics(self.accumulator, self.truth.categories, area_ranges)
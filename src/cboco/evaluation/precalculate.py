@@ -1,15 +1,16 @@
 from typing import List, Dict, Tuple
 import itertools
 
-from tqdm import tqdm
-
 from ..dataset import Annotation
+from .. import profiling
 
 
+@profiling.timed('precalculate_combinatorial_ious')
 def precalculate_combinatorial_ious(tann: List[Annotation], pann: List[Annotation], method: Annotation.IoUMethod, show_progress: bool) -> Dict[Tuple[int, int], float]:
     combinations = itertools.product(tann, pann)
     n = len(tann)*len(pann)
     if show_progress:
+        from tqdm import tqdm
         combinations = tqdm(combinations, total=n)
     ious = {}
     for t, p in combinations:
@@ -0,0 +1,74 @@
+"""
+Content hashes of files, remembered per (path, size, mtime) so that each
+file is only read once, and optionally kept between runs.
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+import hashlib
+import json
+import os
+import threading
+
+from . import profiling
+
+
+# (path, size, mtime) -> digest
+_digests: Dict[Tuple[str, int, int], str] = {}
+_lock = threading.Lock()
+
+
+def _memo_key(fn: str) -> Tuple[str, int, int]:
+    st = os.stat(fn)
+    return os.path.abspath(fn), st.st_size, st.st_mtime_ns
+
+
+def file_digest(fn: str) -> str:
+    """sha256 of the contents of file $fn."""
+    memo_key = _memo_key(fn)
+    digest = _digests.get(memo_key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(fn, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        digest = h.hexdigest()
+        profiling.count('files hashed')
+        with _lock:
+            _digests[memo_key] = digest
+    return digest
+
+
+@profiling.timed('file_digests')
+def file_digests(fns: Iterable[str], workers: Optional[int] = None) -> List[str]:
+    """
+    sha256 of the contents of each of files $fns, hashed in parallel by
+    $workers threads (hashing releases the GIL).
+    """
+    fns = list(fns)
+    if workers == 1 or len(fns) < 2:
+        return [file_digest(fn) for fn in fns]
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(file_digest, fns))
+
+
+def load_digests(fn: str):
+    """Remember digests saved by save_digests() in $fn, if it exists."""
+    if not os.path.exists(fn):
+        return
+    with open(fn) as f:
+        entries = json.load(f)
+    with _lock:
+        for path, size, mtime, digest in entries:
+            _digests.setdefault((path, size, mtime), digest)
+
+
+def save_digests(fn: str):
+    """Save digests of all files hashed so far (that still exist unchanged) to $fn."""
+    with _lock:
+        entries = [[*k, v] for k, v in _digests.items()]
+    entries = [e for e in entries if os.path.exists(e[0]) and _memo_key(e[0]) == tuple(e[:3])]
+    os.makedirs(os.path.dirname(os.path.abspath(fn)), exist_ok=True)
+    tmp = f'{fn}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(entries, f)
+    os.replace(tmp, fn)
@@ -0,0 +1,104 @@
+"""
+Lightweight named timers and counters.
+
+Instrumentation is off by default, in which case timers and counters cost
+a single flag check. Turn on with enable() (or `--profile` on the CLI).
+
+Timers and counters may be used from any thread of this process. Those
+used in worker processes (e.g. of bootstrapping or mask export) record
+into the worker's own copy of this module, so are not reported.
+"""
+from typing import Dict
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+import json
+import threading
+import time
+
+
+_enabled = False
+_times = defaultdict(float)
+_calls = defaultdict(int)
+_counters = defaultdict(int)
+_lock = threading.Lock()
+
+
+def enable(v=True):
+    global _enabled
+    _enabled = v
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset():
+    with _lock:
+        _times.clear()
+        _calls.clear()
+        _counters.clear()
+
+
+@contextmanager
+def timer(name: str):
+    """Time the enclosed block, accumulating under $name."""
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            _times[name] += elapsed
+            _calls[name] += 1
+
+
+def timed(name: str):
+    """Decorator timing every call of the decorated function under $name."""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return f(*args, **kwargs)
+            with timer(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name: str, n=1):
+    """Increment counter $name by $n."""
+    if _enabled:
+        with _lock:
+            _counters[name] += n
+
+
+def report() -> Dict[str, dict]:
+    with _lock:
+        return dict(
+            timers={
+                name: dict(calls=_calls[name], total=t, mean=t/_calls[name])
+                for name, t in sorted(_times.items(), key=lambda kv: -kv[1])
+            },
+            counters=dict(_counters),
+        )
+
+
+def print_report():
+    rep = report()
+    print('\nProfile')
+    print(' {:40} | {:>8} | {:>10} | {:>10}'.format('Timer', 'Calls', 'Total (s)', 'Mean (ms)'))
+    for name, t in rep['timers'].items():
+        print(' {:40} | {:>8} | {:>10.3f} | {:>10.3f}'.format(name, t['calls'], t['total'], t['mean']*1e3))
+    if rep['counters']:
+        print(' {:40} | {:>8}'.format('Counter', 'Count'))
+        for name, n in rep['counters'].items():
+            print(' {:40} | {:>8}'.format(name, n))
+
+
+def write_report(fn: str):
+    with open(fn, 'w') as f:
+        json.dump(report(), f, indent=2)
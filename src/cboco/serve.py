@@ -0,0 +1,148 @@
+"""
+Evaluation daemon, keeping truth datasets loaded between requests.
+
+Requests are JSON objects POSTed to /eval:
+
+    {
+        "truth": "path/to/truth.json",
+        "preds": "path/to/preds.json",  (or an inline COCO-format dataset)
+        "thresholds": [0.5, 0.75],      (optional, default COCO 0.5:0.95)
+        "iou_method": "Box",            (optional, or "Mask")
+        "class_agnostic": false,        (optional)
+        "matching": "coco"              (optional, or "legacy")
+    }
+
+and are answered with {"metrics": {...}}, or {"error": "..."} on failure.
+GET /truths lists the truth datasets currently held. Requests are handled
+concurrently, each in its own thread.
+"""
+from typing import Dict, Optional, Tuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+import json
+import os
+import stat
+import threading
+
+from .dataset import Dataset, Annotation
+from . import profiling
+
+
+COCO_THRESHOLDS = [v*0.01 for v in range(50, 100, 5)]
+
+
+class TruthStore:
+    """
+    Truth datasets by path, loaded on first use and reloaded if the file
+    changes. Masks drawn while evaluating are kept with the dataset, so each
+    is only drawn once.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.datasets: Dict[str, Tuple[int, Dataset]] = {}
+        self.loading: Dict[str, threading.Lock] = {}
+
+    def get(self, fn: str) -> Dataset:
+        fn = os.path.abspath(fn)
+        mtime = os.stat(fn).st_mtime_ns
+        with self.lock:
+            lock = self.loading.setdefault(fn, threading.Lock())
+        # only one thread loads a given file; others wait for it
+        with lock:
+            loaded = self.datasets.get(fn)
+            if loaded is None or loaded[0] != mtime:
+                loaded = mtime, Dataset.from_json(fn)
+                self.datasets[fn] = loaded
+        return loaded[1]
+
+    def paths(self):
+        return list(self.datasets)
+
+
+@profiling.timed('serve: evaluate')
+def evaluate_request(request: dict, truths: TruthStore) -> Dict[str, float]:
+    from .evaluation import evaluate_dataset
+
+    truth = truths.get(request['truth'])
+    preds = request['preds']
+    if isinstance(preds, str):
+        preds = Dataset.from_json(preds)
+    else:
+        preds = Dataset.from_dict(preds)
+
+    return evaluate_dataset(
+        preds, truth,
+        iou_method=Annotation.IoUMethod[request.get('iou_method', 'Box')],
+        iou_thresh=request.get('thresholds', COCO_THRESHOLDS),
+        class_agnostic=request.get('class_agnostic', False),
+        matching=request.get('matching', 'coco'),
+        show_progress=False,
+    )
+
+
+class EvaluationRequestHandler(BaseHTTPRequestHandler):
+
+    def address_string(self) -> str:
+        # unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'local'
+
+    def send_json(self, status: int, data: dict):
+        body = json.dumps(data, default=float).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/truths':
+            self.send_json(200, dict(truths=self.server.truths.paths()))
+        else:
+            self.send_json(404, dict(error=f'Unknown path "{self.path}".'))
+
+    def do_POST(self):
+        if self.path != '/eval':
+            self.send_json(404, dict(error=f'Unknown path "{self.path}".'))
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            metrics = evaluate_request(request, self.server.truths)
+        except Exception as e:
+            self.send_json(400, dict(error=f'{type(e).__name__}: {e}'))
+        else:
+            self.send_json(200, dict(metrics=metrics))
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(
+        host='127.0.0.1',
+        port=8642,
+        socket_path: Optional[str] = None,
+        truths: Optional[TruthStore] = None,
+        quiet=False):
+    """
+    Evaluation server listening on $host:$port, or on unix socket
+    $socket_path if given. Call serve_forever() on the result to run. A
+    socket left at $socket_path is replaced; FileExistsError is raised if
+    anything else is there.
+    """
+    if socket_path is not None:
+        if os.path.lexists(socket_path):
+            if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+                raise FileExistsError(f'"{socket_path}" exists and is not a socket.')
+            os.remove(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, EvaluationRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), EvaluationRequestHandler)
+        server.daemon_threads = True
+    server.truths = truths or TruthStore()
+    server.quiet = quiet
+    return server
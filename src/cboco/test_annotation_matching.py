@@ -1,5 +1,7 @@
-from cboco.dataset import Annotation
-from cboco.evaluation.match import match_pred_to_truth
+import numpy as np
+
+from cboco.dataset import Annotation, iou_matrix
+from cboco.evaluation.match import match_pred_to_truth, match_image
 from cboco.evaluation.precalculate import precalculate_combinatorial_ious
 
 
@@ -82,4 +84,49 @@ def test_annot_match_4():
     ]
     ious = precalculate_combinatorial_ious(a, b, Annotation.IoUMethod.Box, show_progress=False)
     rv = match_pred_to_truth(a[0], b, ious, 0.5, False)
-    assert not rv
\ No newline at end of file
+    assert not rv
+
+def test_iou_matrix():
+    a = [
+        Annotation(1, 1, [], 1, None, (0, 0, 50, 50), 1.0),
+        Annotation(2, 1, [], 1, None, (100, 100, 150, 150), 1.0),
+    ]
+    b = [
+        Annotation(1, 1, [], 1, None, (12.5, 12.5, 62.5, 62.5), 1.0),
+        Annotation(2, 1, [], 1, None, (5, 5, 50, 50), 1.0),
+        Annotation(3, 1, [], 1, None, (60, 60, 70, 70), 1.0),
+    ]
+    ious = iou_matrix(a, b, Annotation.IoUMethod.Box)
+    assert ious.shape == (2, 3)
+    for i, ai in enumerate(a):
+        for j, bj in enumerate(b):
+            assert abs(ious[i, j] - ai.box_iou(bj)) < 1e-9
+
+
+def test_match_image_one_to_one():
+    # both preds overlap both truths; the higher scoring pred is the best match for either truth
+    truths = [
+        Annotation(1, 1, [], 1, None, (0, 0, 50, 50), 1.0),
+        Annotation(2, 1, [], 1, None, (0, 0, 50, 47), 1.0),
+    ]
+    preds = [
+        Annotation(1, 1, [], 1, None, (0, 0, 50, 45), 0.5),
+        Annotation(2, 1, [], 1, None, (0, 0, 50, 48), 0.9),
+    ]
+    ious = iou_matrix(truths, preds)
+    cats = np.ones(2, np.int64)
+    scores = np.array([0.5, 0.9])
+
+    # pred 2 has the higher score so takes its best truth (2) first, leaving truth 1 for pred 1
+    truth_match, pred_match = match_image(ious, cats, cats, [0.5, 0.95], False, scores)
+    assert truth_match.tolist() == [[0, 1], [-1, 1]]
+    assert pred_match.tolist() == [[0, 1], [-1, 1]]
+
+    # legacy: each truth takes its best pred, so pred 2 is matched twice
+    truth_match, pred_match = match_image(ious, cats, cats, [0.5, 0.95], False, scores, one_to_one=False)
+    assert truth_match.tolist() == [[1, 1], [1, 1]]
+    assert pred_match.tolist() == [[-1, 1], [-1, 1]]
+
+    # different categories never match
+    truth_match, _ = match_image(ious, cats, cats + 1, [0.5], False, scores)
+    assert truth_match.tolist() == [[-1, -1]]
@@ -1,6 +1,6 @@
 import os
 
-from cboco.dataset import Dataset, Category
+from cboco.dataset import Dataset, Category, iter_datasets
 
 def test_dataset_creation_truly_empty():
     dataset = Dataset.empty([])
@@ -16,4 +16,237 @@ def test_dataset_from_json():
     dataset_a = Dataset.from_json(os.path.join('test_data', 'A.json'))
     assert len(dataset_a.images) == 5
     dataset_b = Dataset.from_json(os.path.join('test_data', 'B.json'))
-    assert len(dataset_b.images) == 5
\ No newline at end of file
+    assert len(dataset_b.images) == 5
+
+def test_dataset_malformed_segmentation():
+    import json
+    import pytest
+    with open(os.path.join('test_data', 'A.json')) as f:
+        data = json.load(f)
+    data['annotations'][0]['segmentation'][0].append(1)
+    with pytest.raises(ValueError):
+        Dataset.from_dict(data)
+    data['annotations'][0]['segmentation'] = []
+    with pytest.raises(ValueError):
+        Dataset.from_dict(data)
+
+def test_iter_datasets_prefetch():
+    fns = [os.path.join('test_data', fn) for fn in ['A.json', 'B.json', 'A.json']]
+    for prefetch in [0, 1, 2, 5]:
+        loaded = list(iter_datasets(fns, prefetch=prefetch))
+        assert [fn for fn, _ in loaded] == fns
+        assert [len(ds.annotations) for _, ds in loaded] == [14, 10, 14]
+
+
+def test_dataset_shard_merge():
+    dataset = Dataset.from_json(os.path.join('test_data', 'A.json'))
+    image_ids = [im.id for im in dataset.images]
+    annotation_ids = [ann.id for ann in dataset.annotations]
+    for method in ['hash', 'dir', 'count']:
+        shards = dataset.shard(3, method)
+        assert len(shards) == 3
+        assert sum(len(s.images) for s in shards) == len(dataset.images)
+        merged = Dataset.merge(shards)
+        assert [im.id for im in merged.images] == image_ids
+        assert [ann.id for ann in merged.annotations] == annotation_ids
+        assert 'shard' not in merged.extra
+
+    # the same images under different directories land in the same shards
+    moved = Dataset.from_json(os.path.join('test_data', 'A.json'))
+    for im in moved.images:
+        im.file_name = '/elsewhere/' + im.file_name
+    for shard, moved_shard in zip(dataset.shard(3, 'hash'), moved.shard(3, 'hash')):
+        assert [im.base_name for im in shard.images] == [im.base_name for im in moved_shard.images]
+
+
+def test_dataset_statistics_combine():
+    dataset = Dataset.from_json(os.path.join('test_data', 'A.json'))
+    expected = dataset.collect_statistics([])
+    combined = Dataset.Statistics.combine(*[s.collect_statistics([]) for s in dataset.shard(2, 'count')])
+    assert combined.num_annotations == expected.num_annotations
+    assert combined.num_annotations_by_class == expected.num_annotations_by_class
+    assert abs(combined.mean_length - expected.mean_length) < 1e-9
+    assert abs(combined.stddev_width - expected.stddev_width) < 1e-9
+
+def test_dataset_union_dedup():
+    from cboco.dataset import deduplicate
+    fn = os.path.join('test_data', 'B.json')
+    original = Dataset.from_json(fn)
+    expected = {im.file_name: len(deduplicate(im.annotations)) for im in original.images}
+
+    merged = Dataset.from_json(fn).union(Dataset.from_json(fn), collision_strategy='merge')
+    assert len(merged.annotations) == 2*len(original.annotations)
+
+    for strategy in ['nms', 'average']:
+        union = Dataset.from_json(fn).union(Dataset.from_json(fn), collision_strategy=strategy)
+        assert {im.file_name: len(im.annotations) for im in union.images} == expected
+        assert len(union.annotations) == sum(expected.values())
+
+def test_dedup_average():
+    from cboco.dataset import deduplicate, Annotation
+
+    def square(x1, y1, x2, y2):
+        return [[x1, y1, x2, y1, x2, y2, x1, y2]]
+
+    segmentations = [
+        square(0, 0, 10, 10), square(2, 0, 12, 10),
+        # past the right edge of the image
+        square(15, 5, 25, 15), square(14, 5, 24, 15),
+    ]
+    dataset = Dataset.from_dict(dict(
+        images=[dict(id=1, file_name='x.png', width=20, height=20)],
+        categories=[dict(id=1, name='foo')],
+        annotations=[
+            dict(id=i, image_id=1, category_id=1, segmentation=seg, score=0.5, area=100)
+            for i, seg in enumerate(segmentations)
+        ],
+    ))
+    voted = deduplicate(dataset.annotations, method='average')
+    assert [ann.bbox for ann in voted] == [(2, 0, 10, 10), (15, 5, 19, 15)]
+    assert all('area' not in ann.extra for ann in voted)
+
+    # annotations of no particular image
+    unplaced = [Annotation.from_contour(ann.contour, 1, score=0.5) for ann in dataset.annotations]
+    assert [ann.bbox for ann in deduplicate(unplaced, method='average')] == [(2, 0, 10, 10), (15, 5, 24, 15)]
+
+def test_dataset_union_by_content(tmp_path):
+    import json
+    from cboco import hashing
+    for fn, content in [('a/x.png', b'frame 1'), ('b/y.png', b'frame 1'), ('b/x.png', b'frame 2')]:
+        (tmp_path / fn).parent.mkdir(exist_ok=True)
+        (tmp_path / fn).write_bytes(content)
+
+    def dataset(*fns):
+        return Dataset.from_dict(dict(
+            images=[dict(id=i, file_name=fn, width=10, height=10) for i, fn in enumerate(fns)],
+            categories=[dict(id=1, name='foo')],
+            annotations=[
+                dict(id=i, image_id=i, category_id=1, segmentation=[[1, 1, 5, 1, 5, 5, 1, 5]])
+                for i, _ in enumerate(fns)
+            ],
+        ), root=str(tmp_path))
+
+    # same frame under different paths merged; different frames kept apart
+    union = dataset('a/x.png').union(dataset('b/y.png', 'b/x.png'), collision_strategy='merge', identify_by='content')
+    assert [(im.file_name, len(im.annotations)) for im in union.images] == [('a/x.png', 2), ('b/x.png', 1)]
+
+    # hashes saved for all files, and loaded hashes used
+    fn = str(tmp_path / 'hashes.json')
+    hashing.save_digests(fn)
+    with open(fn) as f:
+        saved = {path for path, *_ in json.load(f) if path.startswith(str(tmp_path))}
+    assert saved == {str(tmp_path / fn) for fn in ['a/x.png', 'b/y.png', 'b/x.png']}
+    new = tmp_path / 'c.png'
+    new.write_bytes(b'frame 3')
+    st = os.stat(new)
+    with open(fn, 'w') as f:
+        json.dump([[str(new), st.st_size, st.st_mtime_ns, 'loaded']], f)
+    hashing.load_digests(fn)
+    assert hashing.file_digest(str(new)) == 'loaded'
+
+    # duplicates within the first dataset are not collisions, as before
+    # identity options were added: the last of them is kept
+    union = dataset('a/x.png', 'a/x.png').union(dataset('b/x.png'))
+    assert [(im.file_name, len(im.annotations)) for im in union.images] == [('a/x.png', 1), ('b/x.png', 1)]
+
+def test_dataset_export_masks(tmp_path):
+    import cv2
+    from cboco.dataset.export import label_path
+    dataset = Dataset.from_json(os.path.join('test_data', 'A.json'))
+    dataset.export_masks(str(tmp_path), processes=2, show_progress=False)
+    for image in dataset.images:
+        semantic = cv2.imread(label_path(str(tmp_path), 'semantic', image.file_name), cv2.IMREAD_UNCHANGED)
+        instance = cv2.imread(label_path(str(tmp_path), 'instance', image.file_name), cv2.IMREAD_UNCHANGED)
+        assert semantic.shape == instance.shape == (image.height, image.width)
+        for i, ann in enumerate(image.annotations, start=1):
+            visible = instance == i
+            assert (visible <= ann.mask).all()
+            assert (semantic[visible] == ann.category_id).all()
+        assert ((semantic > 0) == (instance > 0)).all()
+
+    # category 0 would be background
+    import pytest
+    dataset.annotations[0].category_id = 0
+    with pytest.raises(ValueError):
+        dataset.export_masks(str(tmp_path), show_progress=False)
+    dataset.export_masks(str(tmp_path), kinds=('instance',), processes=1, show_progress=False)
+
+def test_dataset_export_masks_paths(tmp_path):
+    import cv2
+    import pytest
+    from cboco.dataset.export import label_path
+
+    def dataset(*fns):
+        return Dataset.from_dict(dict(
+            images=[dict(id=i, file_name=fn, width=20, height=20) for i, fn in enumerate(fns)],
+            categories=[dict(id=1, name='foo')],
+            annotations=[
+                # two polygons of different lengths
+                dict(id=i, image_id=i, category_id=1, segmentation=[[1, 1, 8, 1, 8, 8, 1, 8], [10, 10, 18, 10, 14, 18]])
+                for i, _ in enumerate(fns)
+            ],
+        ))
+
+    ds = dataset('a/x.png')
+    ds.export_masks(str(tmp_path), processes=1, show_progress=False)
+    semantic = cv2.imread(label_path(str(tmp_path), 'semantic', 'a/x.png'), cv2.IMREAD_UNCHANGED)
+    assert ((semantic > 0) == ds.annotations[0].mask).all()
+
+    for fns in [('../x.png',), ('/abs/x.png',), ('a/x.jpg', 'a/x.png')]:
+        with pytest.raises(ValueError):
+            dataset(*fns).export_masks(str(tmp_path / 'bad'), processes=1, show_progress=False)
+    assert not (tmp_path / 'bad').exists()
+
+def test_dataset_validate():
+    import json
+    from cboco.dataset.validate import validate, validate_json
+    fn = os.path.join('test_data', 'A.json')
+    assert validate_json(fn) == []
+
+    with open(fn) as f:
+        data = json.load(f)
+    anns = data['annotations']
+    anns[0]['segmentation'] = [[1, 1, 2, 2]]
+    anns[1]['segmentation'] = [[1, 1, 5, 1, 9, 1]]
+    anns[2]['segmentation'] = [[-5, 1, 5, 1, 5, 9]]
+    anns[3]['image_id'] = -1
+    anns[4]['id'] = anns[5]['id']
+    anns[6]['segmentation'] = [[-0.5, 1, 5, 1, 5, 9]]
+    anns[7]['segmentation'] = dict(size=[10, 10], counts='abc')
+    data['images'][0]['width'] += 1
+    data['images'][1]['file_name'] = 'missing.png'
+    kinds = sorted(p.kind for p in validate(data, root='test_data'))
+    assert kinds == sorted([
+        'degenerate polygon', 'degenerate polygon', 'degenerate box', 'out of bounds', 'out of bounds',
+        'orphan annotation', 'duplicate annotation id', 'size mismatch', 'missing file',
+        'unsupported segmentation',
+    ])
+
+
+def test_dataset_validate_malformed():
+    import json
+    from cboco.dataset.validate import validate
+    with open(os.path.join('test_data', 'A.json')) as f:
+        data = json.load(f)
+    anns = data['annotations']
+    # flat and non-numeric segmentations are reported for their annotation only
+    anns[0]['segmentation'] = [1, 1, 5, 1, 5, 5]
+    anns[1]['segmentation'] = [[1, 1, 5, 'x', 5, 5]]
+    anns[2]['segmentation'] = 5
+    # images without a size aren't checked for bounds
+    del data['images'][3]['width']
+    data['images'][4]['height'] = '384'
+    anns[3]['segmentation'] = [[1, 1, 5000, 1, 5000, 5000]]
+    anns[10]['segmentation'] = [[1, 1, 5000, 1, 5000, 5000]]
+    # zero size once truncated to pixels
+    anns[4]['segmentation'] = [[1.2, 1, 1.8, 5, 1.5, 9]]
+    anns[5]['segmentation'] = [[1, 1, 5.5, 1.9, 9, 1.1]]
+    problems = validate(data, root='test_data')
+    by_kind = sorted((p.kind, p.message) for p in problems)
+    assert [k for k, _ in by_kind] == sorted([
+        'invalid segmentation', 'invalid segmentation', 'invalid segmentation',
+        'missing size', 'invalid size',
+        'degenerate box', 'degenerate polygon', 'degenerate box', 'degenerate polygon',
+    ])
+    invalid = [m for k, m in by_kind if k == 'invalid segmentation']
+    assert all(any(f'Annotation {anns[i]["id"]} ' in m for m in invalid) for i in range(3))
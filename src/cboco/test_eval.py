@@ -1,7 +1,14 @@
 import os
 
-from cboco.dataset import Dataset
-from cboco.evaluation import evaluate_dataset
+import numpy as np
+import pytest
+
+from cboco.dataset import Dataset, Annotation
+from cboco.evaluation import evaluate_dataset, evaluate_dataset_breakdown, OnlineEvaluator
+from cboco.evaluation import accumulate_dataset, bootstrap_intervals, Accumulator
+from cboco.evaluation import ResultCache, cached_accumulate, pr_curves, save_curves
+from cboco.evaluation.bootstrap import _resampling_data, _weighted_metrics, bootstrap_metrics
+from cboco.evaluation.ap import calculate_AP_from_arrays, precision_at_recall
 from cboco.evaluation.intersection import get_datasets_intersection
 
 
@@ -45,4 +52,257 @@ def test_eval_2():
         true,
         iou_thresh=[0.5, 0.55, 0.6, 0.65, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95],
     )
-    assert all([results_same[k] == results_oneless[k] for k in results_same.keys()])
\ No newline at end of file
+    assert all([results_same[k] == results_oneless[k] for k in results_same.keys()])
+
+def test_online_eval():
+    thresholds = [0.5, 0.55, 0.6, 0.65, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95]
+    true = Dataset.from_json(os.path.join('test_data', 'A.json'))
+    preds = Dataset.from_json(os.path.join('test_data', 'B.json'))
+    expected = evaluate_dataset(preds, true, iou_thresh=thresholds, iou_method=Annotation.IoUMethod.Mask)
+
+    evaluator = OnlineEvaluator(true, iou_thresh=thresholds, iou_method=Annotation.IoUMethod.Mask)
+    for image in sorted(preds.images, key=lambda i: i.base_name):
+        annotations = [
+            Annotation.from_contour(ann.contour, ann.category_id, score=ann.score)
+            for ann in image.annotations
+        ]
+        evaluator.add(image.file_name, annotations)
+        # reported as we go: new predictions are merged into those ranked so far
+        ranked = evaluator.accumulator.ranked()
+        scores, pred_is_tp, _ = evaluator.accumulator.concatenated()
+        order = np.argsort(-scores, kind='stable')
+        assert (ranked[0] == scores[order]).all() and (ranked[1] == pred_is_tp[:, order]).all()
+    results = evaluator.metrics()
+    assert results.keys() == expected.keys()
+    assert all([abs(results[k] - expected[k]) < 1e-9 for k in expected.keys()])
+
+    # re-adding an image replaces its results
+    evaluator.add(preds.images[0].file_name, [])
+    assert len(evaluator) == len(preds.images)
+    assert evaluator.metrics()['mF1'] < results['mF1']
+
+
+def test_eval_breakdown():
+    thresholds = [0.5, 0.55, 0.6, 0.65, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95]
+    true = Dataset.from_json(os.path.join('test_data', 'A.json'))
+    preds = Dataset.from_json(os.path.join('test_data', 'B.json'))
+    expected = evaluate_dataset(preds, true, iou_thresh=thresholds)
+    breakdown = evaluate_dataset_breakdown(
+        preds, true,
+        iou_thresh=thresholds,
+        area_ranges={'all': (0, float('inf')), 'none': (0, 1)},
+    )
+    assert breakdown.overall == expected
+    assert breakdown.by_area['all'] == expected
+    assert breakdown.by_area['none']['mF1'] == 0.0
+    assert set(breakdown.by_category) == set(cat.name for cat in true.categories)
+
+    # per-category results are the same as evaluating only that category
+    cat = true.categories[1]
+    for ds in [true, preds]:
+        for image in ds.images:
+            image.annotations = [ann for ann in image.annotations if ann.category_id == cat.id]
+    only_cat = evaluate_dataset(preds, true, iou_thresh=thresholds)
+    assert all([abs(only_cat[k] - breakdown.by_category[cat.name][k]) < 1e-9 for k in only_cat.keys()])
+
+
+def test_eval_bootstrap():
+    thresholds = [0.5, 0.75]
+    true = Dataset.from_json(os.path.join('test_data', 'A.json'))
+    preds = Dataset.from_json(os.path.join('test_data', 'B.json'))
+    accumulator = accumulate_dataset(preds, true, iou_thresh=thresholds)
+    expected = accumulator.metrics()
+
+    # resample drawing each image exactly once is the original dataset
+    data = _resampling_data(accumulator)
+    unweighted = _weighted_metrics(data, thresholds, True, np.ones((1, len(accumulator))))
+    assert all([abs(unweighted[k][0] - expected[k]) < 1e-9 for k in expected.keys()])
+
+    # AP of weighted resamples is that of the resampled predictions
+    weights = np.random.default_rng(0).multinomial(len(accumulator), np.full(len(accumulator), 1.0/len(accumulator)), size=20)
+    weighted = _weighted_metrics(data, thresholds, True, weights.astype(np.float64))
+    scores, pred_is_tp, _ = accumulator.concatenated()
+    for w, ap in zip(weights, weighted['AP_50']):
+        pred_weights = w[data['pred_image']]
+        gtp = w @ data['num_truth']
+        assert abs(ap - calculate_AP_from_arrays(np.repeat(scores, pred_weights), np.repeat(pred_is_tp[0], pred_weights), gtp)) < 1e-9
+
+    intervals = bootstrap_intervals(accumulator, n_resamples=200, processes=1, seed=1)
+    assert intervals == bootstrap_intervals(accumulator, n_resamples=200, processes=1, seed=1)
+    assert intervals == bootstrap_intervals(accumulator, n_resamples=200, processes=2, seed=1)
+    with pytest.raises(ValueError):
+        bootstrap_metrics(accumulator, n_resamples=0)
+    assert intervals.keys() == expected.keys()
+    assert all([0.0 <= lo <= hi <= 1.0 for lo, hi in intervals.values()])
+
+    # predictions without scores have no AP
+    for ann in preds.annotations:
+        ann.score = None
+    accumulator = accumulate_dataset(preds, true, iou_thresh=thresholds, show_progress=False)
+    intervals = bootstrap_intervals(accumulator, n_resamples=20, processes=1, seed=1)
+    assert intervals.keys() == accumulator.metrics().keys()
+    assert np.isnan(intervals['mAP']).all()
+
+
+def test_eval_shards(tmp_path):
+    thresholds = [0.5, 0.55, 0.6, 0.65, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95]
+    true = Dataset.from_json(os.path.join('test_data', 'A.json'))
+    preds = Dataset.from_json(os.path.join('test_data', 'B.json'))
+    expected = evaluate_dataset(preds, true, iou_thresh=thresholds)
+
+    partials = []
+    for i, (true_shard, preds_shard) in enumerate(zip(true.shard(2, 'hash'), preds.shard(2, 'hash'))):
+        fn = str(tmp_path / f'{i}.npz')
+        accumulate_dataset(preds_shard, true_shard, iou_thresh=thresholds).save(fn)
+        partials.append(Accumulator.load(fn))
+    results = Accumulator.merge(partials).metrics()
+    assert all([abs(results[k] - expected[k]) < 1e-9 for k in expected.keys()])
+    with pytest.raises(ValueError):
+        Accumulator.merge([])
+
+
+def test_eval_cache(tmp_path):
+    thresholds = [0.5, 0.55, 0.6, 0.65, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95]
+    true_fn, preds_fn = os.path.join('test_data', 'A.json'), os.path.join('test_data', 'B.json')
+    true, preds = Dataset.from_json(true_fn), Dataset.from_json(preds_fn)
+    cache = ResultCache(str(tmp_path))
+
+    loads = []
+    def load(fn):
+        loads.append(fn)
+        return Dataset.from_json(fn)
+
+    for thresh in [thresholds, thresholds, [0.5, 0.52]]:
+        for agnostic in [False, True]:
+            expected = evaluate_dataset(preds, true, iou_thresh=thresh, class_agnostic=agnostic)
+            acc = cached_accumulate(preds_fn, true_fn, cache, iou_thresh=thresh, class_agnostic=agnostic, load=load)
+            results = acc.metrics()
+            assert all([abs(results[k] - expected[k]) < 1e-9 for k in expected.keys()])
+    # IoUs calculated once, and reused for the other settings
+    assert len(loads) == 2
+
+    # corrupt entries are misses, and are replaced
+    for entry in tmp_path.glob('*.npz'):
+        entry.write_bytes(b'not a zip file')
+    acc = cached_accumulate(preds_fn, true_fn, cache, iou_thresh=thresholds, load=load)
+    assert len(loads) == 4
+    assert cache.get_accumulator(cache.key(**{'x': 1})) is None
+
+    # least recently used entries evicted beyond size limit, but not files
+    # being written
+    (tmp_path / 'partial.tmp').write_bytes(b'...')
+    cache.max_size = 0
+    cache.evict()
+    assert [p.name for p in tmp_path.iterdir()] == ['partial.tmp']
+
+
+def test_eval_incremental(tmp_path):
+    thresholds = [0.5, 0.55, 0.6, 0.65, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95]
+    true = Dataset.from_json(os.path.join('test_data', 'A.json'))
+    preds = Dataset.from_json(os.path.join('test_data', 'B.json'))
+
+    evaluator = OnlineEvaluator(true, iou_thresh=thresholds)
+    assert len(evaluator.update(preds)) == len(preds.images)
+    fn = str(tmp_path / 'state.npz')
+    evaluator.save(fn)
+
+    # drop one image's predictions and another image entirely
+    preds.images[0].annotations = preds.images[0].annotations[1:]
+    removed = preds.images.pop()
+    evaluator = OnlineEvaluator.load(fn, true)
+    assert evaluator.update(preds) == [preds.images[0].hashable_name]
+    assert removed.hashable_name not in evaluator.digests
+
+    results = evaluator.metrics()
+    expected = evaluate_dataset(preds, true, iou_thresh=thresholds)
+    assert all([abs(results[k] - expected[k]) < 1e-9 for k in expected.keys()])
+    assert evaluator.update(preds) == []
+
+    # masks depend on image size, so resized images are re-evaluated
+    true.images[1].width += 1
+    assert evaluator.update(preds) == [true.images[1].hashable_name]
+
+    # by mask, a chunk at a time
+    evaluator = OnlineEvaluator(true, iou_method=Annotation.IoUMethod.Mask, iou_thresh=thresholds)
+    evaluator.update(preds, memory_budget=1)
+    expected = evaluate_dataset(preds, true, iou_method=Annotation.IoUMethod.Mask, iou_thresh=thresholds)
+    results = evaluator.metrics()
+    assert all([abs(results[k] - expected[k]) < 1e-9 for k in expected.keys()])
+
+
+def test_eval_confusion(tmp_path):
+    true = Dataset.from_json(os.path.join('test_data', 'A.json'))
+    preds = Dataset.from_json(os.path.join('test_data', 'B.json'))
+    category_ids = [cat.id for cat in true.categories]
+    n = len(category_ids)
+    truth_counts = [sum(a.category_id == c for a in true.annotations) for c in category_ids]
+    cm = accumulate_dataset(preds, true, iou_thresh=[0.5], confusion=True).confusion_matrix(category_ids)[0]
+    assert cm.shape == (n + 1, n + 1)
+    # every truth and every prediction counted once
+    assert (cm[:n].sum(axis=1) == truth_counts).all()
+    assert (cm[:, :n].sum(axis=0) == [sum(a.category_id == c for a in preds.annotations) for c in category_ids]).all()
+
+    # with legacy matching too, every truth is counted once
+    legacy = accumulate_dataset(preds, true, iou_thresh=[0.5], matching='legacy', confusion=True)
+    assert (legacy.confusion_matrix(category_ids)[0][:n].sum(axis=1) == truth_counts).all()
+
+    # relabelled predictions show up off the diagonal
+    relabelled = category_ids[0]
+    for ann in preds.annotations:
+        ann.category_id = relabelled
+    acc = accumulate_dataset(preds, true, iou_thresh=[0.5], confusion=True)
+    confused = acc.confusion_matrix(category_ids)[0]
+    assert confused[:, 1:n].sum() == 0
+    assert confused[:n, 0].sum() == cm[:n, :n].sum()
+
+    fn = str(tmp_path / 'acc.npz')
+    acc.save(fn)
+    assert (Accumulator.load(fn).confusion_matrix(category_ids) == acc.confusion_matrix(category_ids)).all()
+
+
+def test_eval_memory_budget():
+    thresholds = [0.5, 0.55, 0.6, 0.65, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95]
+    true = Dataset.from_json(os.path.join('test_data', 'A.json'))
+    preds = Dataset.from_json(os.path.join('test_data', 'B.json'))
+    expected = evaluate_dataset(preds, true, iou_thresh=thresholds, iou_method=Annotation.IoUMethod.Mask)
+
+    true = Dataset.from_json(os.path.join('test_data', 'A.json'))
+    preds = Dataset.from_json(os.path.join('test_data', 'B.json'))
+    # budget of one image pair's masks: images evaluated one by one
+    budget = max(im.width*im.height*len(im.annotations) for im in true.images + preds.images)*2
+    results = evaluate_dataset(
+        preds, true, iou_thresh=thresholds, iou_method=Annotation.IoUMethod.Mask, memory_budget=budget)
+    assert all([abs(results[k] - expected[k]) < 1e-9 for k in expected.keys()])
+    assert all(ann._mask is None for ann in true.annotations + preds.annotations)
+
+
+def test_eval_curves(tmp_path):
+    thresholds = [0.5, 0.75]
+    true = Dataset.from_json(os.path.join('test_data', 'A.json'))
+    preds = Dataset.from_json(os.path.join('test_data', 'B.json'))
+    acc = accumulate_dataset(preds, true, iou_thresh=thresholds)
+    results = acc.metrics()
+    assert all(isinstance(v, float) for v in evaluate_dataset(preds, true, iou_thresh=thresholds).values())
+    curves = pr_curves(acc, true.categories)
+    n_cat = len(true.categories)
+    assert curves['precision'].shape == (2, 101)
+    assert curves['precision_by_category'].shape == (n_cat, 2, 101)
+    # interpolated precision never increases with recall, and is 0 beyond the recall reached
+    assert (np.diff(curves['precision'], axis=1) <= 0).all()
+    for i, thresh in enumerate(thresholds):
+        recall = results[f'R_{int(thresh*100)}']
+        assert (curves['precision'][i, curves['recall'] > recall + 1e-9] == 0).all()
+        assert curves['precision'][i, 0] > 0
+
+    fn = str(tmp_path / 'curves.npz')
+    save_curves(fn, curves)
+    with np.load(fn) as data:
+        assert data['precision'].dtype == np.float32
+        assert np.allclose(data['precision'], curves['precision'])
+        assert list(data['category_names']) == [cat.name for cat in true.categories]
+
+    # levels not exactly representable still count as reached
+    recall = np.linspace(0.0, 1.0, 11)
+    assert recall[3] != 0.3
+    precision = precision_at_recall(np.array([0.9, 0.8, 0.7, 0.6]), np.array([True, True, False, True]), 10, recall)
+    assert precision[3] == 3/4
@@ -0,0 +1,45 @@
+import os
+
+from cboco import profiling
+from cboco.dataset import Dataset
+
+
+def test_profiling_disabled():
+    profiling.reset()
+    Dataset.from_json(os.path.join('test_data', 'A.json'))
+    assert not profiling.report()['timers']
+
+
+def test_profiling_enabled():
+    profiling.reset()
+    profiling.enable()
+    try:
+        Dataset.from_json(os.path.join('test_data', 'A.json'))
+        Dataset.from_json(os.path.join('test_data', 'B.json'))
+    finally:
+        profiling.enable(False)
+    rep = profiling.report()
+    assert rep['timers']['Dataset.from_json']['calls'] == 2
+    assert rep['counters']['annotations loaded'] == 24
+    profiling.reset()
+
+
+def test_profiling_threads():
+    from concurrent.futures import ThreadPoolExecutor
+
+    def work(_):
+        for _ in range(1000):
+            with profiling.timer('work'):
+                profiling.count('work done')
+
+    profiling.reset()
+    profiling.enable()
+    try:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(work, range(8)))
+    finally:
+        profiling.enable(False)
+    rep = profiling.report()
+    assert rep['timers']['work']['calls'] == 8000
+    assert rep['counters']['work done'] == 8000
+    profiling.reset()
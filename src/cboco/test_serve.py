@@ -0,0 +1,67 @@
+import json
+import os
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from cboco.dataset import Dataset
+from cboco.evaluation import evaluate_dataset
+from cboco.serve import make_server
+
+
+def post(url: str, request: dict) -> dict:
+    req = urllib.request.Request(url, data=json.dumps(request).encode(), method='POST')
+    try:
+        with urllib.request.urlopen(req) as resp:
+            return json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        return json.loads(e.read())
+
+
+def test_serve():
+    thresholds = [0.5, 0.75]
+    true_fn, preds_fn = os.path.join('test_data', 'A.json'), os.path.join('test_data', 'B.json')
+    expected = evaluate_dataset(
+        Dataset.from_json(preds_fn), Dataset.from_json(true_fn), iou_thresh=thresholds, show_progress=False)
+    with open(preds_fn) as f:
+        inline_preds = json.load(f)
+
+    server = make_server(port=0, quiet=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/eval'
+    try:
+        requests = [
+            dict(truth=true_fn, preds=preds, thresholds=thresholds)
+            for preds in [preds_fn, inline_preds]*4
+        ]
+        with ThreadPoolExecutor(4) as pool:
+            responses = list(pool.map(lambda r: post(url, r), requests))
+        for response in responses:
+            results = response['metrics']
+            assert all([abs(results[k] - expected[k]) < 1e-9 for k in expected.keys()])
+        assert server.truths.paths() == [os.path.abspath(true_fn)]
+
+        assert 'error' in post(url, dict(truth='missing.json', preds=preds_fn))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_serve_socket_path(tmp_path):
+    fn = str(tmp_path / 'cboco.sock')
+    # a stale socket from an earlier server is replaced
+    make_server(socket_path=fn, quiet=True).server_close()
+    server = make_server(socket_path=fn, quiet=True)
+    server.server_close()
+    os.remove(fn)
+
+    # anything else is left alone
+    with open(fn, 'w') as f:
+        f.write('keep')
+    with pytest.raises(FileExistsError):
+        make_server(socket_path=fn, quiet=True)
+    with open(fn) as f:
+        assert f.read() == 'keep'
@@ -0,0 +1,32 @@
+import os
+import subprocess
+import sys
+
+
+HEAVY_MODULES = ['numpy', 'cv2', 'tqdm', 'imutils', 'scipy']
+
+
+def heavy_modules_imported_by(*args) -> list:
+    code = '\n'.join([
+        'import runpy, sys',
+        f'sys.argv = ["cboco", *{list(args)!r}]',
+        'try:',
+        '    runpy.run_module("cboco", run_name="__main__")',
+        'except SystemExit:',
+        '    pass',
+        f'print("imported:" + ",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))',
+    ])
+    env = dict(os.environ, PYTHONPATH=os.path.abspath('src'))
+    proc = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True)
+    imported = proc.stdout.strip().splitlines()[-1]
+    assert imported.startswith('imported:')
+    return [m for m in imported[len('imported:'):].split(',') if m]
+
+
+def test_startup_help():
+    assert heavy_modules_imported_by('--help') == []
+    assert heavy_modules_imported_by('eval', '--help') == []
+
+
+def test_startup_unit():
+    assert heavy_modules_imported_by('unit', os.path.join('test_data', 'A.json')) == []